@@ -1,16 +1,32 @@
 import gevent
+import gevent.pool
+import gevent.event
+import gevent.queue
 import gserial.posix
 
+N = 2
+done = gevent.event.Event()
+replies = gevent.queue.Queue(maxsize=N)
+group = gevent.pool.Group()
+
 def loop():
-  for i in range(1000):
+  i = 0
+  while not done.wait(0.4):
     print(i)
-    gevent.sleep(0.4)
+    i += 1
+
+def reader(serial):
+  for _ in range(N):
+    replies.put(serial.readline())
 
-t1 = gevent.spawn(loop)
+group.spawn(loop)
 s1 = gserial.posix.Serial('/tmp/roadrunner')
+group.spawn(reader, s1)
 
-s1.write(b'*IDN?\n')
-print(s1.readline())
+# pipeline all requests in a single write
+s1.write(N * b'*IDN?\n')
+for _ in range(N):
+  print(replies.get())
 
-s1.write(b'*IDN?\n')
-print(s1.readline())
+done.set()
+group.join()
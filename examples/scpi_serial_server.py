@@ -1,34 +1,40 @@
 import os
 import pty
 import tty
-import time
 
 name = '/tmp/roadrunner'
-if os.path.islink(name):
+try:
     os.unlink(name)
+except FileNotFoundError:
+    pass
 master, slave = pty.openpty()
 tty.setraw(master)
 port = os.ttyname(slave)
 os.symlink(port, name)
 
+IDN_REPLY = b'RoadRunner, ACME Inc., v1013, 234567\n'
+ERR_REPLY = b'ERROR: Unknown command\n'
+
+# replies indexed by upper case command
+COMMANDS = {
+    b'*IDN?': IDN_REPLY,
+}
+
 
 def handle():
+    read, write = os.read, os.write
     while True:
-        data = os.read(master, 1024)
-        datau = data.upper().strip().decode()
+        data = read(master, 65536)
         print('processing {!r}'.format(data))
-        if datau == '*IDN?':
-            msg = 'RoadRunner, ACME Inc., v1013, 234567\n'
-        else:
-            msg = 'ERROR: Unknown command\n'
-        print('start reply with: \'', end='', flush=True)
-        for c in msg:
-            os.write(master, c.encode())
-            if c in '\n\r\t':
-                c = repr(c)[1:-1]
-            print(c, end='', flush=True)
-            time.sleep(0.02)
-        print('\'... [DONE]')
+        replies = []
+        # clients may pipeline several commands in a single write
+        for line in data.split(b'\n'):
+            cmd = line.strip().upper()
+            if cmd:
+                replies.append(COMMANDS.get(cmd, ERR_REPLY))
+        msg = b''.join(replies)
+        write(master, msg)
+        print('replied with {!r}'.format(msg))
 
 
 print('Ready to accept requests on {}'.format(name))
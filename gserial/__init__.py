@@ -17,6 +17,55 @@ protocol_handler_packages = [
     'gserial',
 ]
 
+
+# protocol -> handler module, filled by register_protocol() and on discovery
+_protocol_registry = {}
+# protocol -> packages searched without finding a handler for it
+_protocol_misses = {}
+
+
+def register_protocol(protocol, module):
+    """\
+    Register the module handling ``protocol://`` URLs. The module can be
+    given as a module object or as the absolute name of the module to import.
+    It must provide a ``Serial`` class or a ``serial_class_for_url`` function.
+    """
+    if isinstance(module, str):
+        module = importlib.import_module(module)
+    _protocol_registry[protocol.lower()] = module
+
+
+def add_protocol_handler_package(package_name):
+    """\
+    Append a package to the list of ``protocol_handler_packages`` searched
+    for protocol handler modules.
+    """
+    protocol_handler_packages.append(package_name)
+
+
+def _discover_protocol(protocol):
+    """\
+    Search the list of ``protocol_handler_packages`` for the module handling
+    the given protocol. A hit is stored in the registry. A miss is remembered
+    together with the packages searched so it is only retried when the list
+    changes. Returns None if no package provides the protocol.
+    """
+    # compared by value: the list may be changed in place or rebound
+    packages = tuple(protocol_handler_packages)
+    if _protocol_misses.get(protocol) == packages:
+        return None
+    module_name = '.{}'.format(protocol)
+    for package_name in packages:
+        try:
+            importlib.import_module(package_name)
+            handler_module = importlib.import_module(module_name, package_name)
+        except ImportError:
+            continue
+        _protocol_registry[protocol] = handler_module
+        return handler_module
+    _protocol_misses[protocol] = packages
+
+
 def serial_for_url(url, *args, **kwargs):
     """\
     Get an instance of the Serial class, depending on port/url. The port is not
@@ -27,37 +76,34 @@ def serial_for_url(url, *args, **kwargs):
     ``protocol_handler_packages``.
     e.g. we want to support a URL ``foobar://``. A module
     ``my_handlers.protocol_foobar`` is provided by the user. Then
-    ``protocol_handler_packages.append("my_handlers")`` would extend the search
+    ``protocol_handler_packages.append("my_handlers")`` (or
+    ``add_protocol_handler_package("my_handlers")``) would extend the search
     path so that ``serial_for_url("foobar://"))`` would work.
+    A handler module can also be registered directly with
+    ``register_protocol("foobar", "my_handlers.protocol_foobar")``.
     """
     # check and remove extra parameter to not confuse the Serial class
     do_open = not kwargs.pop('do_not_open', False)
     # the default is to use the native implementation
     klass = Serial
     try:
-        url_lowercase = url.lower()
+        idx = url.find('://')
     except AttributeError:
         # it's not a string, use default
         pass
     else:
-        # if it is an URL, try to import the handler module from the list of possible packages
-        if '://' in url_lowercase:
-            protocol = url_lowercase.split('://', 1)[0]
-            module_name = '.{}'.format(protocol)
-            for package_name in protocol_handler_packages:
-                try:
-                    importlib.import_module(package_name)
-                    handler_module = importlib.import_module(module_name, package_name)
-                except ImportError:
-                    continue
-                else:
-                    if hasattr(handler_module, 'serial_class_for_url'):
-                        url, klass = handler_module.serial_class_for_url(url)
-                    else:
-                        klass = handler_module.Serial
-                    break
-            else:
+        # if it is an URL, use the handler module of its protocol
+        if idx >= 0:
+            protocol = url[:idx].lower()
+            handler_module = _protocol_registry.get(protocol) or \
+                _discover_protocol(protocol)
+            if handler_module is None:
                 raise ValueError('invalid URL, protocol {!r} not known'.format(protocol))
+            serial_class_for_url = getattr(handler_module, 'serial_class_for_url', None)
+            if serial_class_for_url is not None:
+                url, klass = serial_class_for_url(url)
+            else:
+                klass = handler_module.Serial
     # instantiate and open when desired
     instance = klass(None, *args, **kwargs)
     instance.port = url
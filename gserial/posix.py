@@ -7,7 +7,6 @@ import termios
 
 import gevent.os
 from gevent import select
-from gevent import fileobject
 
 from . import base
 from .util import to_bytes, Timeout
@@ -20,6 +19,11 @@ class PlatformSpecificBase(object):
     def _set_special_baudrate(self, baudrate):
         raise NotImplementedError('non-standard baudrates are not supported on this platform')
 
+    def _set_termios_special_baudrate(self, attr, baudrate):
+        """Apply termios attributes together with a non-standard baudrate."""
+        termios.tcsetattr(self._raw_fd, termios.TCSANOW, attr)
+        self._set_special_baudrate(baudrate)
+
     def _set_rs485_mode(self, rs485_settings):
         raise NotImplementedError('RS485 not supported on this platform')
 
@@ -31,21 +35,36 @@ class PlatformSpecificBase(object):
         Set break: Controls TXD. When active, no transmitting is possible.
         """
         if self._break_state:
-            fcntl.ioctl(self.fileno(), TIOCSBRK)
+            fcntl.ioctl(self._raw_fd, TIOCSBRK)
         else:
-            fcntl.ioctl(self.fileno(), TIOCCBRK)
+            fcntl.ioctl(self._raw_fd, TIOCCBRK)
 
 
 # some systems support an extra flag to enable the two in POSIX unsupported
 # paritiy settings for MARK and SPACE
 CMSPAR = 0  # default, for unsupported platforms, override below
 
+# break ioctls. try to use values from termios, use defaults from linux
+# otherwise. OS X and BSD override them below
+TIOCSBRK = getattr(termios, 'TIOCSBRK', 0x5427)
+TIOCCBRK = getattr(termios, 'TIOCCBRK', 0x5428)
+
+# termios flags missing on some systems. 0 when unsupported so that they can
+# be set and cleared unconditionally
+ECHOCTL = getattr(termios, 'ECHOCTL', 0)
+ECHOKE = getattr(termios, 'ECHOKE', 0)
+IUCLC = getattr(termios, 'IUCLC', 0)
+PARMRK = getattr(termios, 'PARMRK', 0)
+IXANY = getattr(termios, 'IXANY', 0)
+# try it with alternate constant name
+CRTSCTS = getattr(termios, 'CRTSCTS', getattr(termios, 'CNEW_RTSCTS', 0))
+
 # try to detect the OS so that a device can be selected...
 # this code block should supply a device() and set_special_baudrate() function
 # for the platform
-plat = sys.platform.lower()
+plat = sys.platform
 
-if plat[:5] == 'linux':    # Linux (confirmed)  # noqa
+if plat.startswith('linux'):    # Linux (confirmed)  # noqa
     import array
 
     # extra termios flags
@@ -55,6 +74,9 @@ if plat[:5] == 'linux':    # Linux (confirmed)  # noqa
     TCGETS2 = 0x802C542A
     TCSETS2 = 0x402C542B
     BOTHER = 0o010000
+    # struct termios2: c_iflag, c_oflag, c_cflag, c_lflag, c_line, c_cc[19],
+    # c_ispeed, c_ospeed
+    TERMIOS2 = struct.Struct('4IB19s2I')
 
     # RS485 ioctls
     TIOCGRS485 = 0x542E
@@ -99,12 +121,21 @@ if plat[:5] == 'linux':    # Linux (confirmed)  # noqa
             4000000: 0o010017
         }
 
+        # ioctl buffers, allocated on first use and reused afterwards. no
+        # need to clear them: each get ioctl fills the buffer before it is
+        # modified and set back
+        _serial_struct = None
+        _termios2 = None
+        _rs485_struct = None
+
         def set_low_latency_mode(self, low_latency_settings):
-            buf = array.array('i', [0] * 32)
+            if self._serial_struct is None:
+                self._serial_struct = array.array('i', [0] * 32)
+            buf = self._serial_struct
 
             try:
                 # get serial_struct
-                fcntl.ioctl(self.fd.fd, termios.TIOCGSERIAL, buf)
+                fcntl.ioctl(self._raw_fd, termios.TIOCGSERIAL, buf)
 
                 # set or unset ASYNC_LOW_LATENCY flag
                 if low_latency_settings:
@@ -113,30 +144,54 @@ if plat[:5] == 'linux':    # Linux (confirmed)  # noqa
                     buf[4] &= ~0x2000
 
                 # set serial_struct
-                fcntl.ioctl(self.fd.fd, termios.TIOCSSERIAL, buf)
+                fcntl.ioctl(self._raw_fd, termios.TIOCSSERIAL, buf)
             except IOError as e:
                 raise ValueError('Failed to update ASYNC_LOW_LATENCY flag to {}: {}'.format(low_latency_settings, e))
 
         def _set_special_baudrate(self, baudrate):
-            # right size is 44 on x86_64, allow for some growth
-            buf = array.array('i', [0] * 64)
+            if self._termios2 is None:
+                # right size is 44 on x86_64, allow for some growth
+                self._termios2 = array.array('i', [0] * 64)
+            buf = self._termios2
             try:
                 # get serial_struct
-                fcntl.ioctl(self.fd.fd, TCGETS2, buf)
+                fcntl.ioctl(self._raw_fd, TCGETS2, buf)
                 # set custom speed
                 buf[2] &= ~termios.CBAUD
                 buf[2] |= BOTHER
                 buf[9] = buf[10] = baudrate
 
                 # set serial_struct
-                fcntl.ioctl(self.fd.fd, TCSETS2, buf)
+                fcntl.ioctl(self._raw_fd, TCSETS2, buf)
+            except IOError as e:
+                raise ValueError('Failed to set custom baud rate ({}): {}'.format(baudrate, e))
+
+        def _set_termios_special_baudrate(self, attr, baudrate):
+            # a single TCSETS2 applies both the attributes and the speed
+            iflag, oflag, cflag, lflag, _, _, cc = attr
+            cc = bytes(c if isinstance(c, int) else ord(c) for c in cc[:19])
+            cflag = cflag & ~termios.CBAUD | BOTHER
+            try:
+                if self._termios2 is None:
+                    # right size is 44 on x86_64, allow for some growth
+                    self._termios2 = array.array('i', [0] * 64)
+                    # fetch c_line, which is not part of attr
+                    fcntl.ioctl(self._raw_fd, TCGETS2, self._termios2)
+                buf = self._termios2
+                line = TERMIOS2.unpack_from(buf)[4]
+                TERMIOS2.pack_into(buf, 0, iflag, oflag, cflag, lflag, line, cc,
+                                   baudrate, baudrate)
+                fcntl.ioctl(self._raw_fd, TCSETS2, buf)
             except IOError as e:
                 raise ValueError('Failed to set custom baud rate ({}): {}'.format(baudrate, e))
 
         def _set_rs485_mode(self, rs485_settings):
-            buf = array.array('i', [0] * 8)  # flags, delaytx, delayrx, padding
+            if self._rs485_struct is None:
+                # flags, delaytx, delayrx, padding
+                self._rs485_struct = array.array('i', [0] * 8)
+            buf = self._rs485_struct
             try:
-                fcntl.ioctl(self.fd.fd, TIOCGRS485, buf)
+                fcntl.ioctl(self._raw_fd, TIOCGRS485, buf)
                 buf[0] |= SER_RS485_ENABLED
                 if rs485_settings is not None:
                     if rs485_settings.loopback:
@@ -157,7 +212,7 @@ if plat[:5] == 'linux':    # Linux (confirmed)  # noqa
                         buf[2] = int(rs485_settings.delay_before_rx * 1000)
                 else:
                     buf[0] = 0  # clear SER_RS485_ENABLED
-                fcntl.ioctl(self.fd.fd, TIOCSRS485, buf)
+                fcntl.ioctl(self._raw_fd, TIOCSRS485, buf)
             except IOError as e:
                 raise ValueError('Failed to set RS485 mode: {}'.format(e))
 
@@ -180,35 +235,26 @@ elif plat == 'cygwin':       # cygwin/win32 (confirmed)
         }
 
 
-elif plat[:6] == 'darwin':   # OS X
+elif plat == 'darwin':   # OS X
     import array
     IOSSIOSPEED = 0x80045402  # _IOW('T', 2, speed_t)
+    TIOCSBRK = 0x2000747B # _IO('t', 123)
+    TIOCCBRK = 0x2000747A # _IO('t', 122)
 
     class PlatformSpecific(PlatformSpecificBase):
         osx_version = os.uname()[2].split('.')
-        TIOCSBRK = 0x2000747B # _IO('t', 123)
-        TIOCCBRK = 0x2000747A # _IO('t', 122)
 
         # Tiger or above can support arbitrary serial speeds
         if int(osx_version[0]) >= 8:
             def _set_special_baudrate(self, baudrate):
                 # use IOKit-specific call to set up high speeds
                 buf = array.array('i', [baudrate])
-                fcntl.ioctl(self.fd.fd, IOSSIOSPEED, buf, 1)
-
-        def _update_break_state(self):
-            """\
-            Set break: Controls TXD. When active, no transmitting is possible.
-            """
-            if self._break_state:
-                fcntl.ioctl(self.fd.fd, PlatformSpecific.TIOCSBRK)
-            else:
-                fcntl.ioctl(self.fd.fd, PlatformSpecific.TIOCCBRK)
+                fcntl.ioctl(self._raw_fd, IOSSIOSPEED, buf, 1)
 
-elif plat[:3] == 'bsd' or \
-     plat[:7] == 'freebsd' or \
-     plat[:6] == 'netbsd' or \
-     plat[:7] == 'openbsd':
+elif plat.startswith(('bsd', 'freebsd', 'netbsd', 'openbsd')):
+
+    TIOCSBRK = 0x2000747B # _IO('t', 123)
+    TIOCCBRK = 0x2000747A # _IO('t', 122)
 
     class ReturnBaudrate(object):
         def __getitem__(self, key):
@@ -220,24 +266,35 @@ elif plat[:3] == 'bsd' or \
         # a literal value.
         BAUDRATE_CONSTANTS = ReturnBaudrate()
 
-        TIOCSBRK = 0x2000747B # _IO('t', 123)
-        TIOCCBRK = 0x2000747A # _IO('t', 122)
-
-
-        def _update_break_state(self):
-            """\
-            Set break: Controls TXD. When active, no transmitting is possible.
-            """
-            if self._break_state:
-                fcntl.ioctl(self.fd.fd, PlatformSpecific.TIOCSBRK)
-            else:
-                fcntl.ioctl(self.fd.fd, PlatformSpecific.TIOCCBRK)
-
 else:
     class PlatformSpecific(PlatformSpecificBase):
         pass
 
 
+# termios cflag bits for each serial setting. stop bits and parity are given
+# as (set, clear) masks
+CHAR_SIZES = {
+    5: termios.CS5,
+    6: termios.CS6,
+    7: termios.CS7,
+    8: termios.CS8,
+}
+STOPBITS_MASKS = {
+    base.STOPBITS_ONE: (0, termios.CSTOPB),
+    # XXX same as TWO.. there is no POSIX support for 1.5
+    base.STOPBITS_ONE_POINT_FIVE: (termios.CSTOPB, 0),
+    base.STOPBITS_TWO: (termios.CSTOPB, 0),
+}
+PARITY_MASKS = {
+    base.PARITY_NONE: (0, termios.PARENB | termios.PARODD | CMSPAR),
+    base.PARITY_EVEN: (termios.PARENB, termios.PARODD | CMSPAR),
+    base.PARITY_ODD: (termios.PARENB | termios.PARODD, CMSPAR),
+}
+if CMSPAR:
+    PARITY_MASKS[base.PARITY_MARK] = (termios.PARENB | CMSPAR | termios.PARODD, 0)
+    PARITY_MASKS[base.PARITY_SPACE] = (termios.PARENB | CMSPAR, termios.PARODD)
+
+
 # load some constants for later use.
 # try to use values from termios, use defaults from linux otherwise
 TIOCMGET = getattr(termios, 'TIOCMGET', 0x5415)
@@ -265,40 +322,90 @@ else:
     TIOCINQ = getattr(termios, 'FIONREAD', 0x541B)
 TIOCOUTQ = getattr(termios, 'TIOCOUTQ', 0x5411)
 
-TIOCM_zero_str = struct.pack('I', 0)
-TIOCM_RTS_str = struct.pack('I', TIOCM_RTS)
-TIOCM_DTR_str = struct.pack('I', TIOCM_DTR)
+# baud rate -> speed code for the B<rate> constants provided by termios
+TERMIOS_BAUDRATES = {
+    int(name[1:]): value for name, value in vars(termios).items()
+    if name[0] == 'B' and name[1:].isdigit()
+}
 
-TIOCSBRK = getattr(termios, 'TIOCSBRK', 0x5427)
-TIOCCBRK = getattr(termios, 'TIOCCBRK', 0x5428)
+# unsigned int exchanged with the TIOCM*/TIOC*Q ioctls
+UINT = struct.Struct('I')
+
+TIOCM_zero_str = UINT.pack(0)
+TIOCM_RTS_str = UINT.pack(TIOCM_RTS)
+TIOCM_DTR_str = UINT.pack(TIOCM_DTR)
 
 
 class File:
+    __slots__ = ('name', 'fd', '_read_watcher', '_write_watcher')
+
     def __init__(self, name):
         self.name = name
         self.fd = os.open(name, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
-        self.writer = fileobject.FileObject(self.fd, 'wb', bufsize=0)
+        # registered once and waited on for every chunk read/written
+        loop = gevent.get_hub().loop
+        self._read_watcher = loop.io(self.fd, 1)
+        self._write_watcher = loop.io(self.fd, 2)
 
     def close(self):
+        self._read_watcher.close()
+        self._write_watcher.close()
         os.close(self.fd)
         self.fd = None
-        self.reader = None
-        self.writer = None
 
     def fileno(self):
         return self.fd
 
-    def read(self, size):
-        read = bytearray()
-        while len(read) < size:
-            r, _, _ = select.select((self,), (), ())
-            assert self in r
-            buf = gevent.os.nb_read(self.fd, size - len(read))
-            read.extend(buf)
+    def read(self, size, timeout=None):
+        """\
+        Read size bytes. If timeout expires first, return what was read
+        until then.
+        """
+        # all the data is often already pending (ex: single byte reads of
+        # framed protocols): return it without going through a bytearray
+        try:
+            buf = os.read(self.fd, size)
+        except BlockingIOError:
+            buf = b''
+        if len(buf) == size:
+            return buf
+        read = bytearray(buf)
+        with gevent.Timeout(timeout, False):
+            while len(read) < size:
+                # data is often already pending: only go through the hub when
+                # the read would block. with VMIN=0 a tty returns no data
+                # instead of raising EAGAIN
+                try:
+                    buf = os.read(self.fd, size - len(read))
+                except BlockingIOError:
+                    buf = None
+                if buf:
+                    read.extend(buf)
+                else:
+                    gevent.get_hub().wait(self._read_watcher)
         return bytes(read)
 
     def write(self, data):
-        return self.writer.write(data)
+        # write plain bytes: the length of a view of multi-byte items counts
+        # items, not bytes
+        data = memoryview(data)
+        if data.c_contiguous:
+            data = data.cast('B')
+        else:
+            data = memoryview(data.tobytes())
+        size = len(data)
+        written = 0
+        while written < size:
+            try:
+                written += os.write(self.fd, data[written:])
+            except BlockingIOError:
+                gevent.get_hub().wait(self._write_watcher)
+        return written
+
+
+# USB serial adapters which batch small reads (ex: FTDI 16ms latency timer)
+# unless low latency mode is enabled
+USB_SERIAL_PREFIXES = ('ttyUSB', 'ttyACM')
 
 
 class Serial(base.SerialBase, PlatformSpecific):
@@ -306,8 +413,18 @@ class Serial(base.SerialBase, PlatformSpecific):
     Serial port class POSIX implementation. Serial port configuration is
     done with termios and fcntl. Runs on Linux and many other Un*x like
     systems.
+
+    USB serial adapters are put in low latency mode when opened, unless
+    the low_latency keyword argument is False.
     """
 
+    # file descriptor of the open port, -1 when closed
+    _raw_fd = -1
+
+    def __init__(self, *args, low_latency=True, **kwargs):
+        self.low_latency = low_latency
+        super(Serial, self).__init__(*args, **kwargs)
+
     def open(self):
         """\
         Open port with current settings. This may throw a SerialException
@@ -317,9 +434,11 @@ class Serial(base.SerialBase, PlatformSpecific):
         if self.is_open:
             raise SerialException("Port is already open.")
         self.fd = None
+        self._termios_attr = None
         # open
         try:
             self.fd = File(self.portstr)
+            self._raw_fd = self.fd.fd
         except OSError as msg:
             self.fd = None
             raise SerialException(msg.errno, "could not open port {}: {}".format(self._port, msg))
@@ -334,9 +453,18 @@ class Serial(base.SerialBase, PlatformSpecific):
                 # also to keep original exception that happened when setting up
                 pass
             self.fd = None
+            self._raw_fd = -1
             raise
         else:
             self.is_open = True
+        if self.low_latency:
+            device = os.path.basename(os.path.realpath(self._port))
+            if device.startswith(USB_SERIAL_PREFIXES):
+                try:
+                    self.set_low_latency_mode(True)
+                except (ValueError, NotImplementedError):
+                    # not supported by the driver or by the platform
+                    pass
         try:
             if not self._dsrdtr:
                 self._update_dtr_state()
@@ -359,11 +487,11 @@ class Serial(base.SerialBase, PlatformSpecific):
         if self._exclusive is not None:
             if self._exclusive:
                 try:
-                    fcntl.flock(self.fd.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(self._raw_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
                 except IOError as msg:
                     raise SerialException(msg.errno, "Could not exclusively lock port {}: {}".format(self._port, msg))
             else:
-                fcntl.flock(self.fd.fd, fcntl.LOCK_UN)
+                fcntl.flock(self._raw_fd, fcntl.LOCK_UN)
 
         custom_baud = None
 
@@ -371,37 +499,36 @@ class Serial(base.SerialBase, PlatformSpecific):
         if self._inter_byte_timeout is not None:
             vmin = 1
             vtime = int(self._inter_byte_timeout * 10)
-        try:
-            orig_attr = termios.tcgetattr(self.fd.fd)
-            iflag, oflag, cflag, lflag, ispeed, ospeed, cc = orig_attr
-        except termios.error as msg:      # if a port is nonexistent but has a /dev file, it'll fail here
-            raise SerialException("Could not configure port: {}".format(msg))
+        # start from the attributes applied last time, if any, to avoid
+        # reading them back from the port on every reconfigure
+        orig_attr = None if force_update else self._termios_attr
+        if orig_attr is None:
+            try:
+                orig_attr = termios.tcgetattr(self._raw_fd)
+            except termios.error as msg:      # if a port is nonexistent but has a /dev file, it'll fail here
+                raise SerialException("Could not configure port: {}".format(msg))
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = orig_attr
+        cc = list(cc)
         # set up raw mode / no echo / binary
         cflag |= (termios.CLOCAL | termios.CREAD)
         lflag &= ~(termios.ICANON | termios.ECHO | termios.ECHOE |
                    termios.ECHOK | termios.ECHONL |
-                   termios.ISIG | termios.IEXTEN)  # |termios.ECHOPRT
-        for flag in ('ECHOCTL', 'ECHOKE'):  # netbsd workaround for Erk
-            if hasattr(termios, flag):
-                lflag &= ~getattr(termios, flag)
+                   termios.ISIG | termios.IEXTEN |  # |termios.ECHOPRT
+                   ECHOCTL | ECHOKE)  # netbsd workaround for Erk
 
         oflag &= ~(termios.OPOST | termios.ONLCR | termios.OCRNL)
-        iflag &= ~(termios.INLCR | termios.IGNCR | termios.ICRNL | termios.IGNBRK)
-        if hasattr(termios, 'IUCLC'):
-            iflag &= ~termios.IUCLC
-        if hasattr(termios, 'PARMRK'):
-            iflag &= ~termios.PARMRK
+        iflag &= ~(termios.INLCR | termios.IGNCR | termios.ICRNL | termios.IGNBRK |
+                   IUCLC | PARMRK)
 
         # setup baud rate
-        try:
-            ispeed = ospeed = getattr(termios, 'B{}'.format(self._baudrate))
-        except AttributeError:
+        ispeed = ospeed = TERMIOS_BAUDRATES.get(self._baudrate)
+        if ispeed is None:
             try:
                 ispeed = ospeed = self.BAUDRATE_CONSTANTS[self._baudrate]
             except KeyError:
                 #~ raise ValueError('Invalid baud rate: %r' % self._baudrate)
                 # may need custom baud rate, it isn't in our list.
-                ispeed = ospeed = getattr(termios, 'B38400')
+                ispeed = ospeed = termios.B38400
                 try:
                     custom_baud = int(self._baudrate)  # store for later
                 except ValueError:
@@ -411,66 +538,35 @@ class Serial(base.SerialBase, PlatformSpecific):
                         raise ValueError('Invalid baud rate: {!r}'.format(self._baudrate))
 
         # setup char len
-        cflag &= ~termios.CSIZE
-        if self._bytesize == 8:
-            cflag |= termios.CS8
-        elif self._bytesize == 7:
-            cflag |= termios.CS7
-        elif self._bytesize == 6:
-            cflag |= termios.CS6
-        elif self._bytesize == 5:
-            cflag |= termios.CS5
-        else:
+        try:
+            char_size = CHAR_SIZES[self._bytesize]
+        except KeyError:
             raise ValueError('Invalid char len: {!r}'.format(self._bytesize))
+        cflag = cflag & ~termios.CSIZE | char_size
         # setup stop bits
-        if self._stopbits == base.STOPBITS_ONE:
-            cflag &= ~(termios.CSTOPB)
-        elif self._stopbits == base.STOPBITS_ONE_POINT_FIVE:
-            cflag |= (termios.CSTOPB)  # XXX same as TWO.. there is no POSIX support for 1.5
-        elif self._stopbits == base.STOPBITS_TWO:
-            cflag |= (termios.CSTOPB)
-        else:
+        try:
+            set_mask, clear_mask = STOPBITS_MASKS[self._stopbits]
+        except KeyError:
             raise ValueError('Invalid stop bit specification: {!r}'.format(self._stopbits))
+        cflag = cflag & ~clear_mask | set_mask
         # setup parity
         iflag &= ~(termios.INPCK | termios.ISTRIP)
-        if self._parity == base.PARITY_NONE:
-            cflag &= ~(termios.PARENB | termios.PARODD | CMSPAR)
-        elif self._parity == base.PARITY_EVEN:
-            cflag &= ~(termios.PARODD | CMSPAR)
-            cflag |= (termios.PARENB)
-        elif self._parity == base.PARITY_ODD:
-            cflag &= ~CMSPAR
-            cflag |= (termios.PARENB | termios.PARODD)
-        elif self._parity == base.PARITY_MARK and CMSPAR:
-            cflag |= (termios.PARENB | CMSPAR | termios.PARODD)
-        elif self._parity == base.PARITY_SPACE and CMSPAR:
-            cflag |= (termios.PARENB | CMSPAR)
-            cflag &= ~(termios.PARODD)
-        else:
+        try:
+            set_mask, clear_mask = PARITY_MASKS[self._parity]
+        except KeyError:
             raise ValueError('Invalid parity: {!r}'.format(self._parity))
+        cflag = cflag & ~clear_mask | set_mask
         # setup flow control
         # xonxoff
-        if hasattr(termios, 'IXANY'):
-            if self._xonxoff:
-                iflag |= (termios.IXON | termios.IXOFF)  # |termios.IXANY)
-            else:
-                iflag &= ~(termios.IXON | termios.IXOFF | termios.IXANY)
+        if self._xonxoff:
+            iflag |= (termios.IXON | termios.IXOFF)  # |IXANY)
         else:
-            if self._xonxoff:
-                iflag |= (termios.IXON | termios.IXOFF)
-            else:
-                iflag &= ~(termios.IXON | termios.IXOFF)
+            iflag &= ~(termios.IXON | termios.IXOFF | IXANY)
         # rtscts
-        if hasattr(termios, 'CRTSCTS'):
-            if self._rtscts:
-                cflag |= (termios.CRTSCTS)
-            else:
-                cflag &= ~(termios.CRTSCTS)
-        elif hasattr(termios, 'CNEW_RTSCTS'):   # try it with alternate constant name
-            if self._rtscts:
-                cflag |= (termios.CNEW_RTSCTS)
-            else:
-                cflag &= ~(termios.CNEW_RTSCTS)
+        if self._rtscts:
+            cflag |= CRTSCTS
+        else:
+            cflag &= ~CRTSCTS
         # XXX should there be a warning if setting up rtscts (and xonxoff etc) fails??
 
         # buffer
@@ -483,15 +579,16 @@ class Serial(base.SerialBase, PlatformSpecific):
             raise ValueError('Invalid vtime: {!r}'.format(vtime))
         cc[termios.VTIME] = vtime
         # activate settings
-        if force_update or [iflag, oflag, cflag, lflag, ispeed, ospeed, cc] != orig_attr:
-            termios.tcsetattr(
-                self.fd.fd,
-                termios.TCSANOW,
-                [iflag, oflag, cflag, lflag, ispeed, ospeed, cc])
-
-        # apply custom baud rate, if any
+        attr = [iflag, oflag, cflag, lflag, ispeed, ospeed, cc]
         if custom_baud is not None:
-            self._set_special_baudrate(custom_baud)
+            self._set_termios_special_baudrate(attr, custom_baud)
+            # attr does not hold the custom speed: read the attributes back
+            # on the next reconfigure
+            self._termios_attr = None
+        else:
+            if force_update or attr != orig_attr:
+                termios.tcsetattr(self._raw_fd, termios.TCSANOW, attr)
+            self._termios_attr = attr
 
         if self._rs485_mode is not None:
             self._set_rs485_mode(self._rs485_mode)
@@ -502,6 +599,8 @@ class Serial(base.SerialBase, PlatformSpecific):
             if self.fd.fd is not None:
                 self.fd.close()
                 self.fd = None
+                self._raw_fd = -1
+                self._termios_attr = None
             self.is_open = False
 
     #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
@@ -509,9 +608,9 @@ class Serial(base.SerialBase, PlatformSpecific):
     @property
     def in_waiting(self):
         """Return the number of bytes currently in the input buffer."""
-        #~ s = fcntl.ioctl(self.fd.fd, termios.FIONREAD, TIOCM_zero_str)
-        s = fcntl.ioctl(self.fd.fd, TIOCINQ, TIOCM_zero_str)
-        return struct.unpack('I', s)[0]
+        #~ s = fcntl.ioctl(self._raw_fd, termios.FIONREAD, TIOCM_zero_str)
+        s = fcntl.ioctl(self._raw_fd, TIOCINQ, TIOCM_zero_str)
+        return UINT.unpack(s)[0]
 
     # select based implementation, proved to work on many systems
     def read(self, size=1):
@@ -522,9 +621,8 @@ class Serial(base.SerialBase, PlatformSpecific):
         """
         if not self.is_open:
             raise portNotOpenError
-        gevent.Timeout(self._timeout)
         try:
-            return self.fd.read(size)
+            return self.fd.read(size, self._timeout)
         except OSError as e:
             # this is for Python 3.x where select.error is a subclass of
             # OSError ignore BlockingIOErrors and EINTR. other errors are shown
@@ -536,9 +634,11 @@ class Serial(base.SerialBase, PlatformSpecific):
         """Output the given byte string over the serial port."""
         if not self.is_open:
             raise portNotOpenError
-        d = to_bytes(data)
-        gevent.Timeout(self._write_timeout)
-        return self.fd.write(d)
+        # buffers are written as they are, without a copy
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = to_bytes(data)
+        with gevent.Timeout(self._write_timeout, writeTimeoutError):
+            return self.fd.write(data)
 
     def flush(self):
         """\
@@ -547,13 +647,13 @@ class Serial(base.SerialBase, PlatformSpecific):
         """
         if not self.is_open:
             raise portNotOpenError
-        termios.tcdrain(self.fd.fd)
+        termios.tcdrain(self._raw_fd)
 
     def reset_input_buffer(self):
         """Clear input buffer, discarding all that is in the buffer."""
         if not self.is_open:
             raise portNotOpenError
-        termios.tcflush(self.fd.fd, termios.TCIFLUSH)
+        termios.tcflush(self._raw_fd, termios.TCIFLUSH)
 
     def reset_output_buffer(self):
         """\
@@ -562,71 +662,65 @@ class Serial(base.SerialBase, PlatformSpecific):
         """
         if not self.is_open:
             raise portNotOpenError
-        termios.tcflush(self.fd.fd, termios.TCOFLUSH)
+        termios.tcflush(self._raw_fd, termios.TCOFLUSH)
 
-    def send_break(self, duration=0.25):
-        """\
-        Send break condition. Timed, returns to idle state after given
-        duration.
-        """
-        if not self.is_open:
-            raise portNotOpenError
-        termios.tcsendbreak(self.fd.fd, int(duration / 0.25))
+    # send_break is inherited from SerialBase: it toggles break_condition
+    # around a gevent.sleep instead of termios.tcsendbreak, which would block
+    # the whole hub for the duration of the break.
 
     def _update_rts_state(self):
         """Set terminal status line: Request To Send"""
         if self._rts_state:
-            fcntl.ioctl(self.fd.fd, TIOCMBIS, TIOCM_RTS_str)
+            fcntl.ioctl(self._raw_fd, TIOCMBIS, TIOCM_RTS_str)
         else:
-            fcntl.ioctl(self.fd.fd, TIOCMBIC, TIOCM_RTS_str)
+            fcntl.ioctl(self._raw_fd, TIOCMBIC, TIOCM_RTS_str)
 
     def _update_dtr_state(self):
         """Set terminal status line: Data Terminal Ready"""
         if self._dtr_state:
-            fcntl.ioctl(self.fd.fd, TIOCMBIS, TIOCM_DTR_str)
+            fcntl.ioctl(self._raw_fd, TIOCMBIS, TIOCM_DTR_str)
         else:
-            fcntl.ioctl(self.fd.fd, TIOCMBIC, TIOCM_DTR_str)
+            fcntl.ioctl(self._raw_fd, TIOCMBIC, TIOCM_DTR_str)
+
+    def modem_status(self):
+        """\
+        Read all terminal status lines with a single ioctl. Returns the
+        TIOCM_* bit mask. Prefer it over reading cts, dsr, ri and cd one
+        after the other since each of those issues its own ioctl.
+        """
+        if not self.is_open:
+            raise portNotOpenError
+        s = fcntl.ioctl(self._raw_fd, TIOCMGET, TIOCM_zero_str)
+        return UINT.unpack(s)[0]
 
     @property
     def cts(self):
         """Read terminal status line: Clear To Send"""
-        if not self.is_open:
-            raise portNotOpenError
-        s = fcntl.ioctl(self.fd.fd, TIOCMGET, TIOCM_zero_str)
-        return struct.unpack('I', s)[0] & TIOCM_CTS != 0
+        return self.modem_status() & TIOCM_CTS != 0
 
     @property
     def dsr(self):
         """Read terminal status line: Data Set Ready"""
-        if not self.is_open:
-            raise portNotOpenError
-        s = fcntl.ioctl(self.fd.fd, TIOCMGET, TIOCM_zero_str)
-        return struct.unpack('I', s)[0] & TIOCM_DSR != 0
+        return self.modem_status() & TIOCM_DSR != 0
 
     @property
     def ri(self):
         """Read terminal status line: Ring Indicator"""
-        if not self.is_open:
-            raise portNotOpenError
-        s = fcntl.ioctl(self.fd.fd, TIOCMGET, TIOCM_zero_str)
-        return struct.unpack('I', s)[0] & TIOCM_RI != 0
+        return self.modem_status() & TIOCM_RI != 0
 
     @property
     def cd(self):
         """Read terminal status line: Carrier Detect"""
-        if not self.is_open:
-            raise portNotOpenError
-        s = fcntl.ioctl(self.fd.fd, TIOCMGET, TIOCM_zero_str)
-        return struct.unpack('I', s)[0] & TIOCM_CD != 0
+        return self.modem_status() & TIOCM_CD != 0
 
     # - - platform specific - - - -
 
     @property
     def out_waiting(self):
         """Return the number of bytes currently in the output buffer."""
-        #~ s = fcntl.ioctl(self.fd.fd, termios.FIONREAD, TIOCM_zero_str)
-        s = fcntl.ioctl(self.fd.fd, TIOCOUTQ, TIOCM_zero_str)
-        return struct.unpack('I', s)[0]
+        #~ s = fcntl.ioctl(self._raw_fd, termios.FIONREAD, TIOCM_zero_str)
+        s = fcntl.ioctl(self._raw_fd, TIOCOUTQ, TIOCM_zero_str)
+        return UINT.unpack(s)[0]
 
     def fileno(self):
         """\
@@ -646,9 +740,9 @@ class Serial(base.SerialBase, PlatformSpecific):
         if not self.is_open:
             raise portNotOpenError
         if enable:
-            termios.tcflow(self.fd.fd, termios.TCION)
+            termios.tcflow(self._raw_fd, termios.TCION)
         else:
-            termios.tcflow(self.fd.fd, termios.TCIOFF)
+            termios.tcflow(self._raw_fd, termios.TCIOFF)
 
     def set_output_flow_control(self, enable=True):
         """\
@@ -659,9 +753,9 @@ class Serial(base.SerialBase, PlatformSpecific):
         if not self.is_open:
             raise portNotOpenError
         if enable:
-            termios.tcflow(self.fd.fd, termios.TCOON)
+            termios.tcflow(self._raw_fd, termios.TCOON)
         else:
-            termios.tcflow(self.fd.fd, termios.TCOOFF)
+            termios.tcflow(self._raw_fd, termios.TCOOFF)
 
     def nonblocking(self):
         """DEPRECATED - has no use"""
@@ -676,6 +770,24 @@ class PosixPollSerial(Serial):
     disconnecting while it's in use (e.g. USB-serial unplugged).
     """
 
+    # receive buffer reused by every read, allocated on first use
+    _rx_buffer = None
+    RX_BUFFER_SIZE = 65536
+
+    # poll object with the port registered, kept while the port is open
+    _poller = None
+
+    def open(self):
+        super(PosixPollSerial, self).open()
+        self._poller = select.poll()
+        self._poller.register(self._raw_fd, select.POLLIN | select.POLLERR | select.POLLHUP | select.POLLNVAL)
+
+    def close(self):
+        if self._poller is not None:
+            self._poller.unregister(self._raw_fd)
+            self._poller = None
+        super(PosixPollSerial, self).close()
+
     def read(self, size=1):
         """\
         Read size bytes from the serial port. If a timeout is set it may
@@ -686,27 +798,23 @@ class PosixPollSerial(Serial):
             raise portNotOpenError
         read = bytearray()
         timeout = Timeout(self._timeout)
-        poll = select.poll()
-        poll.register(self.fd.fd, select.POLLIN | select.POLLERR | select.POLLHUP | select.POLLNVAL)
-        poll.register(self.pipe_abort_read_r, select.POLLIN | select.POLLERR | select.POLLHUP | select.POLLNVAL)
+        if self._rx_buffer is None:
+            self._rx_buffer = memoryview(bytearray(self.RX_BUFFER_SIZE))
+        rx_buffer = self._rx_buffer
+        poll = self._poller.poll
         if size > 0:
             while len(read) < size:
                 # print "\tread(): size",size, "have", len(read)    #debug
                 # wait until device becomes ready to read (or something fails)
-                for fd, event in poll.poll(None if timeout.is_infinite else (timeout.time_left() * 1000)):
-                    if fd == self.pipe_abort_read_r:
-                        break
+                for fd, event in poll(None if timeout.is_infinite else (timeout.time_left() * 1000)):
                     if event & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
                         raise SerialException('device reports error (poll)')
                     #  we don't care if it is select.POLLIN or timeout, that's
                     #  handled below
-                if fd == self.pipe_abort_read_r:
-                    os.read(self.pipe_abort_read_r, 1000)
-                    break
-                buf = os.read(self.fd.fd, size - len(read))
-                read.extend(buf)
+                n = os.readv(self._raw_fd, (rx_buffer[:size - len(read)],))
+                read.extend(rx_buffer[:n])
                 if timeout.expired() \
-                        or (self._inter_byte_timeout is not None and self._inter_byte_timeout > 0) and not buf:
+                        or (self._inter_byte_timeout is not None and self._inter_byte_timeout > 0) and not n:
                     break   # early abort on timeout
         return bytes(read)
 
@@ -726,7 +834,7 @@ class VTIMESerial(Serial):
     def _reconfigure_port(self, force_update=True):
         """Set communication parameters on opened port."""
         super(VTIMESerial, self)._reconfigure_port()
-        fcntl.fcntl(self.fd.fd, fcntl.F_SETFL, 0)  # clear O_NONBLOCK
+        fcntl.fcntl(self._raw_fd, fcntl.F_SETFL, 0)  # clear O_NONBLOCK
 
         if self._inter_byte_timeout is not None:
             vmin = 1
@@ -738,7 +846,7 @@ class VTIMESerial(Serial):
             vmin = 0
             vtime = int(self._timeout * 10)
         try:
-            orig_attr = termios.tcgetattr(self.fd.fd)
+            orig_attr = termios.tcgetattr(self._raw_fd)
             iflag, oflag, cflag, lflag, ispeed, ospeed, cc = orig_attr
         except termios.error as msg:      # if a port is nonexistent but has a /dev file, it'll fail here
             raise SerialException("Could not configure port: {}".format(msg))
@@ -749,7 +857,7 @@ class VTIMESerial(Serial):
         cc[termios.VMIN] = vmin
 
         termios.tcsetattr(
-                self.fd.fd,
+                self._raw_fd,
                 termios.TCSANOW,
                 [iflag, oflag, cflag, lflag, ispeed, ospeed, cc])
 
@@ -763,7 +871,7 @@ class VTIMESerial(Serial):
             raise portNotOpenError
         read = bytearray()
         while len(read) < size:
-            buf = os.read(self.fd.fd, size - len(read))
+            buf = os.read(self._raw_fd, size - len(read))
             if not buf:
                 break
             read.extend(buf)
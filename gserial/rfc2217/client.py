@@ -1,48 +1,58 @@
 import struct
 import logging
 import functools
-import telnetlib
 import urllib.parse
 
 import gevent.lock
 import gevent.event
-import gevent.queue
 import gevent.socket
 
 from gserial import base
-from gserial.util import Timeout, Strip, iter_bytes, to_bytes
+from gserial.util import Timeout, Strip, to_bytes, SINGLE_BYTES
 from gserial.exception import SerialException, portNotOpenError
 
 
 log = logging.getLogger('gserial.rfc2217')
 
+# map log level names to constants. used in from_url()
+LOGGER_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
 # telnet protocol characters
-SE = telnetlib.SE    # Subnegotiation End
-NOP = telnetlib.NOP   # No Operation
-DM = telnetlib.DM    # Data Mark
-BRK = telnetlib.BRK   # Break
-IP = telnetlib.IP    # Interrupt process
-AO = telnetlib.AO    # Abort output
-AYT = telnetlib.AYT   # Are You There
-EC = telnetlib.EC    # Erase Character
-EL = telnetlib.EL    # Erase Line
-GA = telnetlib.GA    # Go Ahead
-SB = telnetlib.SB    # Subnegotiation Begin
-WILL = telnetlib.WILL
-WONT = telnetlib.WONT
-DO = telnetlib.DO
-DONT = telnetlib.DONT
-IAC = telnetlib.IAC # Interpret As Command
+SE = b'\xf0'    # Subnegotiation End
+NOP = b'\xf1'   # No Operation
+DM = b'\xf2'    # Data Mark
+BRK = b'\xf3'   # Break
+IP = b'\xf4'    # Interrupt process
+AO = b'\xf5'    # Abort output
+AYT = b'\xf6'   # Are You There
+EC = b'\xf7'    # Erase Character
+EL = b'\xf8'    # Erase Line
+GA = b'\xf9'    # Go Ahead
+SB = b'\xfa'    # Subnegotiation Begin
+WILL = b'\xfb'
+WONT = b'\xfc'
+DO = b'\xfd'
+DONT = b'\xfe'
+IAC = b'\xff' # Interpret As Command
 IAC_DOUBLED = 2*IAC
 
 # selected telnet options
-BINARY = telnetlib.BINARY    # 8-bit data path
-ECHO = telnetlib.ECHO      # echo
-SGA = telnetlib.SGA # suppress go ahead
+BINARY = b'\x00'    # 8-bit data path
+ECHO = b'\x01'      # echo
+SGA = b'\x03' # suppress go ahead
 
 # RFC2217
 COM_PORT_OPTION = b'\x2c'
 
+# frame of the RFC2217 subnegotiations
+SUBNEGOTIATION_START = IAC + SB + COM_PORT_OPTION
+SUBNEGOTIATION_END = IAC + SE
+
 # Client to Access Server
 SET_BAUDRATE = b'\x01'
 SET_DATASIZE = b'\x02'
@@ -114,50 +124,10 @@ PURGE_TRANSMIT_BUFFER = b'\x02'     # Purge access server transmit data buffer
 PURGE_BOTH_BUFFERS = b'\x03'        # Purge both the access server receive data
                                     # buffer and the access server transmit data buffer
 
-SET_CONTROL_REQ_FLOW_SETTING = b'\x00'        # Request Com Port Flow Control Setting (outbound/both)
-SET_CONTROL_USE_NO_FLOW_CONTROL = b'\x01'     # Use No Flow Control (outbound/both)
-SET_CONTROL_USE_SW_FLOW_CONTROL = b'\x02'     # Use XON/XOFF Flow Control (outbound/both)
-SET_CONTROL_USE_HW_FLOW_CONTROL = b'\x03'     # Use HARDWARE Flow Control (outbound/both)
-SET_CONTROL_REQ_BREAK_STATE = b'\x04'         # Request BREAK State
-SET_CONTROL_BREAK_ON = b'\x05'                # Set BREAK State ON
-SET_CONTROL_BREAK_OFF = b'\x06'               # Set BREAK State OFF
-SET_CONTROL_REQ_DTR = b'\x07'                 # Request DTR Signal State
-SET_CONTROL_DTR_ON = b'\x08'                  # Set DTR Signal State ON
-SET_CONTROL_DTR_OFF = b'\x09'                 # Set DTR Signal State OFF
-SET_CONTROL_REQ_RTS = b'\x0a'                 # Request RTS Signal State
-SET_CONTROL_RTS_ON = b'\x0b'                  # Set RTS Signal State ON
-SET_CONTROL_RTS_OFF = b'\x0c'                 # Set RTS Signal State OFF
-SET_CONTROL_REQ_FLOW_SETTING_IN = b'\x0d'     # Request Com Port Flow Control Setting (inbound)
-SET_CONTROL_USE_NO_FLOW_CONTROL_IN = b'\x0e'  # Use No Flow Control (inbound)
-SET_CONTROL_USE_SW_FLOW_CONTOL_IN = b'\x0f'   # Use XON/XOFF Flow Control (inbound)
-SET_CONTROL_USE_HW_FLOW_CONTOL_IN = b'\x10'   # Use HARDWARE Flow Control (inbound)
-SET_CONTROL_USE_DCD_FLOW_CONTROL = b'\x11'    # Use DCD Flow Control (outbound/both)
-SET_CONTROL_USE_DTR_FLOW_CONTROL = b'\x12'    # Use DTR Flow Control (inbound)
-SET_CONTROL_USE_DSR_FLOW_CONTROL = b'\x13'    # Use DSR Flow Control (outbound/both)
-
-LINESTATE_MASK_TIMEOUT = 128        # Time-out Error
-LINESTATE_MASK_SHIFTREG_EMPTY = 64  # Transfer Shift Register Empty
-LINESTATE_MASK_TRANSREG_EMPTY = 32  # Transfer Holding Register Empty
-LINESTATE_MASK_BREAK_DETECT = 16    # Break-detect Error
-LINESTATE_MASK_FRAMING_ERROR = 8    # Framing Error
-LINESTATE_MASK_PARTIY_ERROR = 4     # Parity Error
-LINESTATE_MASK_OVERRUN_ERROR = 2    # Overrun Error
-LINESTATE_MASK_DATA_READY = 1       # Data Ready
-
-MODEMSTATE_MASK_CD = 128            # Receive Line Signal Detect (also known as Carrier Detect)
-MODEMSTATE_MASK_RI = 64             # Ring Indicator
-MODEMSTATE_MASK_DSR = 32            # Data-Set-Ready Signal State
-MODEMSTATE_MASK_CTS = 16            # Clear-To-Send Signal State
-MODEMSTATE_MASK_CD_CHANGE = 8       # Delta Receive Line Signal Detect
-MODEMSTATE_MASK_RI_CHANGE = 4       # Trailing-edge Ring Detector
-MODEMSTATE_MASK_DSR_CHANGE = 2      # Delta Data-Set-Ready
-MODEMSTATE_MASK_CTS_CHANGE = 1      # Delta Clear-To-Send
-
-PURGE_RECEIVE_BUFFER = b'\x01'      # Purge access server receive data buffer
-PURGE_TRANSMIT_BUFFER = b'\x02'     # Purge access server transmit data buffer
-PURGE_BOTH_BUFFERS = b'\x03'        # Purge both the access server receive data
-                                    # buffer and the access server transmit data buffer
 
+# network order values of the port settings subnegotiations
+UINT32 = struct.Struct('!I')    # baudrate
+UINT8 = struct.Struct('!B')     # datasize, parity, stopsize
 
 RFC2217_PARITY_MAP = {
     base.PARITY_NONE: 1,
@@ -175,6 +145,19 @@ RFC2217_STOPBIT_MAP = {
 }
 RFC2217_REVERSE_STOPBIT_MAP = dict((v, k) for k, v in RFC2217_STOPBIT_MAP.items())
 
+# TCP keepalive (idle time, probe interval, probe count) so that a dead
+# server is detected in about a minute. not available on all platforms
+TCP_KEEPALIVE_OPTIONS = tuple(
+    (getattr(gevent.socket, name), value)
+    for name, value in (('TCP_KEEPIDLE', 30), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3))
+    if hasattr(gevent.socket, name))
+
+# integer codes of the telnet commands handled by the read loop, which
+# looks at single ints of the receive buffer
+IAC_CODE, SB_CODE, SE_CODE = IAC[0], SB[0], SE[0]
+# telnet commands followed by an option
+NEGOTIATION_CODES = (DO[0], DONT[0], WILL[0], WONT[0])
+
 # Telnet filter states
 M_NORMAL = 0
 M_IAC_SEEN = 1
@@ -226,27 +209,17 @@ class TelnetOption(object):
         answer when needed.
         """
         if command == self.ack_yes:
-            if self.state is REQUESTED:
-                self.activate()
-            elif self.state is ACTIVE:
-                pass
-            elif self.state is INACTIVE:
-                self.activate(send=True)
-            elif self.state is REALLY_INACTIVE:
-                self.connection.telnet_send_option(self.send_no, self.option)
-            else:
-                raise ValueError('option in illegal state {!r}'.format(self))
+            agreed = True
         elif command == self.ack_no:
-            if self.state is REQUESTED:
-                self.deactivate()
-            elif self.state is ACTIVE:
-                self.deactivate(send=True)
-            elif self.state is INACTIVE:
-                pass
-            elif self.state is REALLY_INACTIVE:
-                pass
-            else:
-                raise ValueError('option in illegal state {!r}'.format(self))
+            agreed = False
+        else:
+            return
+        try:
+            action = self._incoming_actions[agreed, self.state]
+        except KeyError:
+            raise ValueError('option in illegal state {!r}'.format(self))
+        if action is not None:
+            action(self)
 
     def activate(self, send=False):
         self.state = ACTIVE
@@ -264,6 +237,21 @@ class TelnetOption(object):
         self.active_event.clear()
         self.deactivation_callback()
 
+    def _reject(self):
+        self.connection.telnet_send_option(self.send_no, self.option)
+
+    # (remote agrees, state) -> what to do on an incoming DO/DONT/WILL/WONT
+    _incoming_actions = {
+        (True, REQUESTED): activate,
+        (True, ACTIVE): None,
+        (True, INACTIVE): lambda option: option.activate(send=True),
+        (True, REALLY_INACTIVE): _reject,
+        (False, REQUESTED): deactivate,
+        (False, ACTIVE): lambda option: option.deactivate(send=True),
+        (False, INACTIVE): None,
+        (False, REALLY_INACTIVE): None,
+    }
+
 
 class TelnetSubnegotiation(object):
     """\
@@ -278,6 +266,7 @@ class TelnetSubnegotiation(object):
         self.name = name
         self.option = option
         self.value = None
+        self._request = None
         self.ack_option = ack_option
         self.state = INACTIVE
         self.active_event = gevent.event.Event()
@@ -292,11 +281,21 @@ class TelnetSubnegotiation(object):
         the client needs to know if the change is performed he has to check the
         state of this object.
         """
-        self.value = value
+        self.connection._internal_raw_write(self.request(value))
+
+    def request(self, value):
+        """\
+        Like set() but return the request instead of sending it, so that
+        several requests can be sent together.
+        """
+        if value != self.value:
+            # the request is only rebuilt when the value changes
+            self.value = value
+            self._request = self.connection.rfc2217_subnegotiation(self.option, value)
         self.state = REQUESTED
         self.active_event.clear()
-        self.connection.rfc2217_send_subnegotiation(self.option, self.value)
-        self.connection.logger.debug("SB Requesting {} -> {!r}".format(self.name, self.value))
+        self.connection.logger.debug("SB Requesting %s -> %r", self.name, self.value)
+        return self._request
 
     def is_ready(self):
         """\
@@ -315,8 +314,8 @@ class TelnetSubnegotiation(object):
         can also throw a value error when the answer from the server does not
         match the value sent.
         """
-        with gevent.Timeout(timeout, SerialException("timeout while waiting for option {!r}".format(self.name))):
-            self.active_event.wait()
+        if not self.active_event.wait(timeout):
+            raise SerialException("timeout while waiting for option {!r}".format(self.name))
 
     def check_answer(self, suboption):
         """\
@@ -330,7 +329,15 @@ class TelnetSubnegotiation(object):
             # error propagation done in is_ready
             self.state = REALLY_INACTIVE
             self.active_event.clear()
-        self.connection.logger.debug("SB Answer {} -> {!r} -> {}".format(self.name, suboption, self.state))
+        self.connection.logger.debug("SB Answer %s -> %r -> %s", self.name, suboption, self.state)
+
+
+def escape(data):
+    """Double the IAC bytes of data (returned as is when there are none)."""
+    # serial data seldom contains IAC: only escape (copy) when needed
+    if IAC in data:
+        return data.replace(IAC, IAC_DOUBLED)
+    return data
 
 
 def ensure_open(f):
@@ -342,6 +349,47 @@ def ensure_open(f):
     return wrapper
 
 
+def _url_logging(serial, values):
+    serial.logger.setLevel(LOGGER_LEVELS[values[0]])
+    serial.logger.debug('enabled logging')
+
+
+def _url_ign_set_control(serial, values):
+    serial._ignore_set_control_answer = True
+
+
+def _url_poll_modem(serial, values):
+    serial._poll_modem_state = True
+
+
+def _url_timeout(serial, values):
+    serial._network_timeout = float(values[0])
+
+
+def _url_reconnect_delay(serial, values):
+    serial._reconnect_delay = float(values[0])
+
+
+def _url_set_control_delay(serial, values):
+    serial._set_control_delay = float(values[0])
+
+
+def _url_coalesce_writes(serial, values):
+    serial._coalesce_writes = True
+
+
+# URL query option -> function applying its values to the serial instance
+URL_OPTIONS = {
+    'logging': _url_logging,
+    'ign_set_control': _url_ign_set_control,
+    'poll_modem': _url_poll_modem,
+    'timeout': _url_timeout,
+    'reconnect_delay': _url_reconnect_delay,
+    'set_control_delay': _url_set_control_delay,
+    'coalesce_writes': _url_coalesce_writes,
+}
+
+
 class Serial(base.SerialBase):
 
     BAUDRATES = (50, 75, 110, 134, 150, 200, 300, 600, 1200, 1800, 2400, 4800,
@@ -352,16 +400,28 @@ class Serial(base.SerialBase):
         self._linestate = 0
         self._modemstate = None
         self._modemstate_timeout = Timeout(-1)
+        self._modemstate_event = None
         self._remote_suspend_flow = False
         self._write_lock = None
         self.logger = log
         self._ignore_set_control_answer = False
         self._poll_modem_state = False
         self._network_timeout = 1
+        self._reconnect_delay = 0
+        self._set_control_delay = 0
+        self._coalesce_writes = False
+        self._write_buffer = None
+        self._write_flusher = None
+        self._write_error = None
         self._telnet_options = None
+        self._telnet_options_by_code = None
         self._rfc2217_port_settings = None
         self._rfc2217_options = None
+        self._rfc2217_options_by_ack = None
+        self._rfc2217_notifications = None
         self._read_buffer = None
+        self._read_event = None
+        self._read_eof = False
         super(Serial, self).__init__(*args, **kwargs)
 
     def open(self):
@@ -372,6 +432,9 @@ class Serial(base.SerialBase):
         self._ignore_set_control_answer = False
         self._poll_modem_state = False
         self._network_timeout = 1
+        self._reconnect_delay = 0
+        self._set_control_delay = 0
+        self._coalesce_writes = False
         if self._port is None:
             raise SerialException("Port must be configured before it can be used.")
         if self.is_open:
@@ -382,20 +445,35 @@ class Serial(base.SerialBase):
             self._socket = gevent.socket.create_connection(addr, timeout=2)
             self._socket.setsockopt(gevent.socket.IPPROTO_TCP,
                                     gevent.socket.TCP_NODELAY, 1)
+            self._socket.setsockopt(gevent.socket.SOL_SOCKET,
+                                    gevent.socket.SO_KEEPALIVE, 1)
+            for option, value in TCP_KEEPALIVE_OPTIONS:
+                self._socket.setsockopt(gevent.socket.IPPROTO_TCP, option, value)
+            # SO_SNDBUF/SO_RCVBUF are left alone: setting them disables the
+            # kernel buffer autotuning which already scales with the link
         except Exception as msg:
             self._socket = None
             raise SerialException("Could not open port {}: {}".format(self.portstr, msg))
 
-        # use a thread save queue as buffer. it also simplifies implementing
-        # the read timeout
-        self._read_buffer = gevent.queue.Queue()
+        # received data. the reader sets the event when it adds data or
+        # when the connection is lost
+        self._read_buffer = bytearray()
+        self._read_event = gevent.event.Event()
+        self._read_eof = False
         # to ensure that user writes does not interfere with internal
         # telnet/rfc2217 options establish a lock
         self._write_lock = gevent.lock.RLock()
+        # user data not sent yet (coalesce_writes option)
+        self._write_buffer = bytearray()
+        self._write_flusher = None
+        # socket error of the last buffered send, reported by the next
+        # write()/flush()
+        self._write_error = None
         # name the following separately so that, below, a check can be easily done
         all_mandatory = gevent.event.Event()
         def event_callback():
-            if sum(o.active for o in mandadory_options) == sum(o.state != INACTIVE for o in mandadory_options):
+            # done when every mandatory option is either active or refused
+            if all(o.active or o.state is INACTIVE for o in mandadory_options):
                 all_mandatory.set()
         mandadory_options = [
             TelnetOption(self, 'we-BINARY', BINARY, WILL, WONT, DO, DONT, INACTIVE, event_callback, event_callback),
@@ -409,6 +487,11 @@ class Serial(base.SerialBase):
             TelnetOption(self, 'they-BINARY', BINARY, DO, DONT, WILL, WONT, INACTIVE),
             TelnetOption(self, 'they-RFC2217', COM_PORT_OPTION, DO, DONT, WILL, WONT, REQUESTED),
         ] + mandadory_options
+        # options by code. can have more than one option per code as some
+        # options are duplicated for 'us' and 'them'
+        self._telnet_options_by_code = {}
+        for option in self._telnet_options:
+            self._telnet_options_by_code.setdefault(option.option, []).append(option)
         # RFC 2217 specific states
         # COM port settings
         self._rfc2217_port_settings = {
@@ -424,10 +507,23 @@ class Serial(base.SerialBase):
             'control':  TelnetSubnegotiation(self, 'control',  SET_CONTROL,  SERVER_SET_CONTROL),
         }
         self._rfc2217_options.update(self._rfc2217_port_settings)
+        # incoming COM_PORT_OPTION handling by sub option code: server
+        # notifications and answers to our requests
+        self._rfc2217_notifications = {
+            SERVER_NOTIFY_LINESTATE: self._rfc2217_notify_linestate,
+            SERVER_NOTIFY_MODEMSTATE: self._rfc2217_notify_modemstate,
+            FLOWCONTROL_SUSPEND: self._rfc2217_flow_suspend,
+            FLOWCONTROL_RESUME: self._rfc2217_flow_resume,
+        }
+        self._rfc2217_options_by_ack = {
+            item.ack_option: item for item in self._rfc2217_options.values()
+        }
         # cache for line and modem states that the server sends to us
         self._linestate = 0
         self._modemstate = None
         self._modemstate_timeout = Timeout(-1)
+        # set on every modem state notification
+        self._modemstate_event = gevent.event.Event()
         # RFC 2217 flow control between server and client
         self._remote_suspend_flow = False
 
@@ -436,16 +532,17 @@ class Serial(base.SerialBase):
 
         try:    # must clean-up if open fails
             # negotiate Telnet/RFC 2217 -> send initial requests
-            for option in self._telnet_options:
-                if option.state is REQUESTED:
-                    self.telnet_send_option(option.send_yes, option.option)
+            self._internal_raw_write(b''.join(
+                IAC + option.send_yes + option.option
+                for option in self._telnet_options
+                if option.state is REQUESTED))
 
             # now wait until important options are negotiated
             timeout_error = SerialException(
                 "Remote does not seem to support RFC2217 or BINARY mode {!r}".format(mandadory_options))
             with gevent.Timeout(self._network_timeout, timeout_error):
                 all_mandatory.wait()
-            self.logger.info("Negotiated options: {}".format(self._telnet_options))
+            self.logger.info("Negotiated options: %s", self._telnet_options)
 
             # fine, go on, set RFC 2271 specific things
             self._reconfigure_port()
@@ -473,22 +570,25 @@ class Serial(base.SerialBase):
             # XXX
 
         # Setup the connection
-        # to get good performance, all parameter changes are sent first...
+        # to get good performance, all parameter changes are sent first
+        # (in a single write)...
         if not 0 < self._baudrate < 2 ** 32:
             raise ValueError("invalid baudrate: {!r}".format(self._baudrate))
-        self._rfc2217_port_settings['baudrate'].set(struct.pack(b'!I', self._baudrate))
-        self._rfc2217_port_settings['datasize'].set(struct.pack(b'!B', self._bytesize))
-        self._rfc2217_port_settings['parity'].set(struct.pack(b'!B', RFC2217_PARITY_MAP[self._parity]))
-        self._rfc2217_port_settings['stopsize'].set(struct.pack(b'!B', RFC2217_STOPBIT_MAP[self._stopbits]))
+        settings = self._rfc2217_port_settings
+        self._internal_raw_write(
+            settings['baudrate'].request(UINT32.pack(self._baudrate)) +
+            settings['datasize'].request(UINT8.pack(self._bytesize)) +
+            settings['parity'].request(UINT8.pack(RFC2217_PARITY_MAP[self._parity])) +
+            settings['stopsize'].request(UINT8.pack(RFC2217_STOPBIT_MAP[self._stopbits])))
 
         # and now wait until parameters are active
         items = self._rfc2217_port_settings.values()
-        self.logger.debug("Negotiating settings: {}".format(items))
-        timeout_error = SerialException(
-            "Remote does not accept parameter change (RFC2217): {!r}".format(items))
-        with gevent.Timeout(self._network_timeout, timeout_error):
-            gevent.wait([o.active_event for o in items])
-        self.logger.info("Negotiated settings: {}".format(items))
+        self.logger.debug("Negotiating settings: %s", items)
+        events = [o.active_event for o in items]
+        if len(gevent.wait(events, self._network_timeout)) < len(events):
+            raise SerialException(
+                "Remote does not accept parameter change (RFC2217): {!r}".format(items))
+        self.logger.info("Negotiated settings: %s", items)
         if self._rtscts and self._xonxoff:
             raise ValueError('xonxoff and rtscts together are not supported')
         elif self._rtscts:
@@ -503,16 +603,28 @@ class Serial(base.SerialBase):
         self.is_open = False
         if self._socket:
             try:
-                self._socket.shutdown(socket.SHUT_RDWR)
-                self._socket.close()
+                self._internal_raw_write()
+                # wakes up the reader: it sees the end of the connection
+                self._socket.shutdown(gevent.socket.SHUT_RDWR)
             except:
                 # ignore errors.
                 pass
-        if self._thread:
-            self._thread.join(7)  # XXX more than socket timeout
+        thread = self._thread
+        if thread:
+            # the reader waits without timeout: if the shut down did not
+            # end it, stop it. either way it wakes up pending reads
+            thread.join(1)
+            thread.kill()
             self._thread = None
-            # in case of quick reconnects, give the server some time
-            gevent.sleep(0.3)
+            # in case of quick reconnects, the server may need some time
+            if self._reconnect_delay:
+                gevent.sleep(self._reconnect_delay)
+        if self._socket:
+            # only close once the reader no longer waits on the socket
+            try:
+                self._socket.close()
+            except:
+                pass
         self._socket = None
 
     def from_url(self, url):
@@ -529,17 +641,11 @@ class Serial(base.SerialBase):
         try:
             # process options now, directly altering self
             for option, values in urllib.parse.parse_qs(parts.query, True).items():
-                if option == 'logging':
-                    self.logger.setLevel(LOGGER_LEVELS[values[0]])
-                    self.logger.debug('enabled logging')
-                elif option == 'ign_set_control':
-                    self._ignore_set_control_answer = True
-                elif option == 'poll_modem':
-                    self._poll_modem_state = True
-                elif option == 'timeout':
-                    self._network_timeout = float(values[0])
-                else:
+                try:
+                    handler = URL_OPTIONS[option]
+                except KeyError:
                     raise ValueError('unknown option: {!r}'.format(option))
+                handler(self, values)
             if not 0 <= parts.port < 65536:
                 raise ValueError("port not in range 0...65535")
         except ValueError as e:
@@ -551,54 +657,77 @@ class Serial(base.SerialBase):
     #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
 
     @property
-    @ensure_open
     def in_waiting(self):
         """Return the number of bytes currently in the input buffer."""
-        return self._read_buffer.qsize()
+        # the hot paths check is_open inline instead of with ensure_open
+        if not self.is_open:
+            raise portNotOpenError
+        return len(self._read_buffer)
 
-    @ensure_open
     def read(self, size=1):
         """\
         Read size bytes from the serial port. If a timeout is set it may
         return less characters as requested. With no timeout it will block
         until the requested number of bytes is read.
         """
-        data = bytearray()
-        timeout = gevent.Timeout(self._timeout)
-        try:
-            while len(data) < size:
+        if not self.is_open:
+            raise portNotOpenError
+        read_buffer = self._read_buffer
+        with gevent.Timeout(self._timeout, False):
+            while len(read_buffer) < size:
+                if self._read_eof:
+                    # report the lost connection once, with the data left
+                    self._read_eof = False
+                    break
                 if self._thread is None or self._thread.ready():
                     raise SerialException('connection failed (reader thread died)')
-                buf = self._read_buffer.get()
-                if buf is None:
-                    break
-                data += buf
-        except gevent.Timeout:
-            pass
-        except gevent.queue.Empty:
-            pass
-        return bytes(data)
+                self._read_event.clear()
+                self._read_event.wait()
+        # copy straight out of the buffer: slicing the bytearray first
+        # would copy twice
+        with memoryview(read_buffer) as view:
+            data = view[:size].tobytes()
+        del read_buffer[:size]
+        return data
 
-    @ensure_open
     def write(self, data):
         """\
         Output the given byte string over the serial port. Can block if the
         connection is blocked. May raise SerialException if the connection is
         closed.
         """
+        if not self.is_open:
+            raise portNotOpenError
+        payload = data if isinstance(data, (bytes, bytearray)) else to_bytes(data)
+        payload = escape(payload)
+        if self._coalesce_writes:
+            self._check_write_error()
+            # send everything written until the next loop iteration at once
+            self._write_buffer += payload
+            if self._write_flusher is None:
+                self._write_flusher = gevent.spawn(self._flush_write_buffer)
+            return len(data)
         try:
-            self._internal_raw_write(to_bytes(data).replace(IAC, IAC_DOUBLED))
+            self._internal_raw_write(payload)
         except gevent.socket.error as e:
             raise SerialException("connection failed (socket error): {}".format(e))
         return len(data)
 
+    @ensure_open
+    def flush(self):
+        """Send the data buffered by the coalesce_writes option now."""
+        self._check_write_error()
+        try:
+            self._internal_raw_write()
+        except gevent.socket.error as e:
+            raise SerialException("connection failed (socket error): {}".format(e))
+
     @ensure_open
     def reset_input_buffer(self):
         """Clear input buffer, discarding all that is in the buffer."""
         self.rfc2217_send_purge(PURGE_RECEIVE_BUFFER)
         # empty read buffer
-        while self._read_buffer.qsize():
-            self._read_buffer.get(False)
+        del self._read_buffer[:]
 
     @ensure_open
     def reset_output_buffer(self):
@@ -606,6 +735,7 @@ class Serial(base.SerialBase):
         Clear output buffer, aborting the current output and
         discarding all that is in the buffer.
         """
+        del self._write_buffer[:]
         self.rfc2217_send_purge(PURGE_TRANSMIT_BUFFER)
 
     @ensure_open
@@ -614,7 +744,7 @@ class Serial(base.SerialBase):
         Set break: Controls TXD. When active, to transmitting is
         possible.
         """
-        self.logger.info('set BREAK to {}'.format('active' if self._break_state else 'inactive'))
+        self.logger.info('set BREAK to %s', 'active' if self._break_state else 'inactive')
         if self._break_state:
             self.rfc2217_set_control(SET_CONTROL_BREAK_ON)
         else:
@@ -623,7 +753,7 @@ class Serial(base.SerialBase):
     @ensure_open
     def _update_rts_state(self):
         """Set terminal status line: Request To Send."""
-        self.logger.info('set RTS to {}'.format('active' if self._rts_state else 'inactive'))
+        self.logger.info('set RTS to %s', 'active' if self._rts_state else 'inactive')
         if self._rts_state:
             self.rfc2217_set_control(SET_CONTROL_RTS_ON)
         else:
@@ -632,35 +762,40 @@ class Serial(base.SerialBase):
     @ensure_open
     def _update_dtr_state(self):
         """Set terminal status line: Data Terminal Ready."""
-        self.logger.info('set DTR to {}'.format('active' if self._dtr_state else 'inactive'))
+        self.logger.info('set DTR to %s', 'active' if self._dtr_state else 'inactive')
         if self._dtr_state:
             self.rfc2217_set_control(SET_CONTROL_DTR_ON)
         else:
             self.rfc2217_set_control(SET_CONTROL_DTR_OFF)
 
-    @property
     @ensure_open
+    def modem_status(self):
+        """\
+        Read all terminal status lines at once. Returns the MODEMSTATE_MASK_*
+        bit mask. Prefer it over reading cts, dsr, ri and cd one after the
+        other since each of those may poll the server.
+        """
+        return self.get_modem_state()
+
+    @property
     def cts(self):
         """Read terminal status line: Clear To Send."""
-        return bool(self.get_modem_state() & MODEMSTATE_MASK_CTS)
+        return self.modem_status() & MODEMSTATE_MASK_CTS != 0
 
     @property
-    @ensure_open
     def dsr(self):
         """Read terminal status line: Data Set Ready."""
-        return bool(self.get_modem_state() & MODEMSTATE_MASK_DSR)
+        return self.modem_status() & MODEMSTATE_MASK_DSR != 0
 
     @property
-    @ensure_open
     def ri(self):
         """Read terminal status line: Ring Indicator."""
-        return bool(self.get_modem_state() & MODEMSTATE_MASK_RI)
+        return self.modem_status() & MODEMSTATE_MASK_RI != 0
 
     @property
-    @ensure_open
     def cd(self):
         """Read terminal status line: Carrier Detect."""
-        return bool(self.get_modem_state() & MODEMSTATE_MASK_CD)
+        return self.modem_status() & MODEMSTATE_MASK_CD != 0
 
     # - - - platform specific - - -
     # None so far
@@ -671,66 +806,87 @@ class Serial(base.SerialBase):
         """Read loop for the socket."""
         mode = M_NORMAL
         suboption = None
+        # receive buffer reused for every recv
+        data = bytearray(65536)
+        view = memoryview(data)
+        # bound once for the per chunk / per IAC work below
+        find = data.find
+        read_buffer = self._read_buffer
+        data_ready = self._read_event.set
+        wait_read = gevent.socket.wait_read
+        recv_into = self._socket.recv_into
+        fileno = self._socket.fileno()
         try:
             while self.is_open:
                 try:
-                    data = self._socket.recv(1024)
-                except gevent.socket.timeout:
-                    # just need to get out of recv form time to time to check if
-                    # still alive
-                    continue
+                    # wait without the socket timeout (only meant for writes):
+                    # no periodic wake ups. close() wakes us up by shutting
+                    # the socket down
+                    wait_read(fileno)
+                    end = recv_into(data)
                 except gevent.socket.error as e:
                     # connection fails -> terminate loop
-                    self.logger.debug("socket error in reader thread: {}".format(e))
-                    self._read_buffer.put(None)
+                    self.logger.debug("socket error in reader thread: %s", e)
                     break
-                self.logger.debug('RECV %r', Strip(data))
-                if not data:
-                    self._read_buffer.put(None)
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug('RECV %r', Strip(data[:end]))
+                if not end:
                     break  # lost connection
-                for byte in iter_bytes(data):
+                pos = 0
+                while pos < end:
                     if mode == M_NORMAL:
-                        # interpret as command or as data
-                        if byte == IAC:
-                            mode = M_IAC_SEEN
+                        # everything up to the next IAC is data: store it in
+                        # one go in read buffer or sub option buffer depending
+                        # on state
+                        iac = find(IAC, pos, end)
+                        if iac < 0:
+                            iac = end
                         else:
-                            # store data in read buffer or sub option buffer
-                            # depending on state
+                            mode = M_IAC_SEEN
+                        if iac > pos:
                             if suboption is not None:
-                                suboption += byte
+                                suboption += view[pos:iac]
                             else:
-                                self._read_buffer.put(byte)
-                    elif mode == M_IAC_SEEN:
-                        if byte == IAC:
+                                read_buffer += view[pos:iac]
+                                data_ready()
+                        pos = iac + 1
+                        continue
+                    code = data[pos]
+                    pos += 1
+                    if mode == M_IAC_SEEN:
+                        if code == IAC_CODE:
                             # interpret as command doubled -> insert character
                             # itself
                             if suboption is not None:
                                 suboption += IAC
                             else:
-                                self._read_buffer.put(IAC)
+                                read_buffer += IAC
+                                data_ready()
                             mode = M_NORMAL
-                        elif byte == SB:
+                        elif code == SB_CODE:
                             # sub option start
                             suboption = bytearray()
                             mode = M_NORMAL
-                        elif byte == SE:
+                        elif code == SE_CODE:
                             # sub option end -> process it now
-                            self._telnet_process_subnegotiation(bytes(suboption))
+                            self._telnet_process_subnegotiation(suboption)
                             suboption = None
                             mode = M_NORMAL
-                        elif byte in (DO, DONT, WILL, WONT):
+                        elif code in NEGOTIATION_CODES:
                             # negotiation
-                            telnet_command = byte
+                            telnet_command = SINGLE_BYTES[code]
                             mode = M_NEGOTIATE
                         else:
                             # other telnet commands
-                            self._telnet_process_command(byte)
+                            self._telnet_process_command(SINGLE_BYTES[code])
                             mode = M_NORMAL
                     elif mode == M_NEGOTIATE:  # DO, DONT, WILL, WONT was received, option now following
-                        self._telnet_negotiate_option(telnet_command, byte)
+                        self._telnet_negotiate_option(telnet_command, SINGLE_BYTES[code])
                         mode = M_NORMAL
         finally:
             self._thread = None
+            self._read_eof = True
+            self._read_event.set()
             self.logger.debug("read thread terminated")
 
     # - incoming telnet commands and options
@@ -744,14 +900,11 @@ class Serial(base.SerialBase):
         """Process incoming DO, DONT, WILL, WONT."""
         # check our registered telnet options and forward command to them
         # they know themselves if they have to answer or not
-        known = False
-        for item in self._telnet_options:
-            # can have more than one match! as some options are duplicated for
-            # 'us' and 'them'
-            if item.option == option:
+        items = self._telnet_options_by_code.get(option)
+        if items:
+            for item in items:
                 item.process_incoming(command)
-                known = True
-        if not known:
+        else:
             # handle unknown options
             # only answer to positive requests and deny them
             if command == WILL or command == DO:
@@ -759,48 +912,90 @@ class Serial(base.SerialBase):
                 self.logger.warning("rejected Telnet option: {!r}".format(option))
 
     def _telnet_process_subnegotiation(self, suboption):
-        """Process subnegotiation, the data between IAC SB and IAC SE."""
-        if suboption[0:1] == COM_PORT_OPTION:
-            option = suboption[1:2]
-            if option == SERVER_NOTIFY_LINESTATE and len(suboption) >= 3:
-                self._linestate = ord(suboption[2:3])  # ensure it is a number
-                self.logger.info("NOTIFY_LINESTATE: {}".format(self._linestate))
-            elif option == SERVER_NOTIFY_MODEMSTATE and len(suboption) >= 3:
-                self._modemstate = ord(suboption[2:3])  # ensure it is a number
-                self.logger.info("NOTIFY_MODEMSTATE: {}".format(self._modemstate))
-                # update time when we think that a poll would make sense
-                self._modemstate_timeout.restart(0.3)
-            elif option == FLOWCONTROL_SUSPEND:
-                self._remote_suspend_flow = True
-            elif option == FLOWCONTROL_RESUME:
-                self._remote_suspend_flow = False
+        """\
+        Process subnegotiation, the data between IAC SB and IAC SE. The
+        bytearray is not copied: handlers slice what they keep.
+        """
+        if suboption[:1] == COM_PORT_OPTION:
+            option = bytes(suboption[1:2])
+            handler = self._rfc2217_notifications.get(option)
+            if handler is not None:
+                handler(suboption)
+                return
+            item = self._rfc2217_options_by_ack.get(option)
+            if item is not None:
+                #~ print "processing COM_PORT_OPTION: %r" % list(suboption[1:])
+                item.check_answer(bytes(suboption[2:]))
             else:
-                for item in self._rfc2217_options.values():
-                    if item.ack_option == option:
-                        #~ print "processing COM_PORT_OPTION: %r" % list(suboption[1:])
-                        item.check_answer(bytes(suboption[2:]))
-                        break
-                else:
-                    self.logger.warning("ignoring COM_PORT_OPTION: {!r}".format(suboption))
+                self.logger.warning("ignoring COM_PORT_OPTION: {!r}".format(suboption))
         else:
             self.logger.warning("ignoring subnegotiation: {!r}".format(suboption))
 
+    def _rfc2217_notify_linestate(self, suboption):
+        if len(suboption) < 3:
+            self.logger.warning("ignoring COM_PORT_OPTION: {!r}".format(suboption))
+            return
+        self._linestate = suboption[2]
+        self.logger.info("NOTIFY_LINESTATE: %s", self._linestate)
+
+    def _rfc2217_notify_modemstate(self, suboption):
+        if len(suboption) < 3:
+            self.logger.warning("ignoring COM_PORT_OPTION: {!r}".format(suboption))
+            return
+        self._modemstate = suboption[2]
+        self.logger.info("NOTIFY_MODEMSTATE: %s", self._modemstate)
+        # update time when we think that a poll would make sense
+        self._modemstate_timeout.restart(0.3)
+        self._modemstate_event.set()
+
+    def _rfc2217_flow_suspend(self, suboption):
+        self._remote_suspend_flow = True
+
+    def _rfc2217_flow_resume(self, suboption):
+        self._remote_suspend_flow = False
+
     # - outgoing telnet commands and options
 
-    def _internal_raw_write(self, data):
-        """internal socket write with no data escaping. used to send telnet stuff."""
+    def _internal_raw_write(self, data=b''):
+        """\
+        internal socket write with no data escaping. used to send telnet stuff.
+        Buffered user data, if any, is sent first.
+        """
         with self._write_lock:
-            self.logger.debug('SEND %r', Strip(data))
-            self._socket.sendall(data)
+            if self._write_buffer:
+                self._write_buffer += data
+                data = bytes(self._write_buffer)
+                del self._write_buffer[:]
+            if data:
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug('SEND %r', Strip(data))
+                self._socket.sendall(data)
+
+    def _flush_write_buffer(self):
+        """Send the buffered user data. Runs in its own greenlet."""
+        self._write_flusher = None
+        try:
+            self._internal_raw_write()
+        except gevent.socket.error as e:
+            self.logger.error("failed to send buffered data: %s", e)
+            self._write_error = e
+
+    def _check_write_error(self):
+        """Raise the socket error of a failed buffered send, if any."""
+        if self._write_error is not None:
+            raise SerialException("connection failed (socket error): {}".format(self._write_error))
 
     def telnet_send_option(self, action, option):
         """Send DO, DONT, WILL, WONT."""
         self._internal_raw_write(IAC + action + option)
 
+    def rfc2217_subnegotiation(self, option, value=b''):
+        """Build the subnegotiation of a RFC2217 parameter."""
+        return b''.join((SUBNEGOTIATION_START, option, escape(value), SUBNEGOTIATION_END))
+
     def rfc2217_send_subnegotiation(self, option, value=b''):
         """Subnegotiation of RFC2217 parameters."""
-        value = value.replace(IAC, IAC_DOUBLED)
-        self._internal_raw_write(IAC + SB + COM_PORT_OPTION + option + value + IAC + SE)
+        self._internal_raw_write(self.rfc2217_subnegotiation(option, value))
 
     def rfc2217_send_purge(self, value):
         """\
@@ -818,19 +1013,13 @@ class Serial(base.SerialBase):
         if self._ignore_set_control_answer:
             # answers are ignored when option is set. compatibility mode for
             # servers that answer, but not the expected one... (or no answer
-            # at all) i.e. sredird
-            gevent.sleep(0.1)  # this helps getting the unit tests passed
+            # at all) i.e. sredird. a delay can be given to let the server
+            # apply the change
+            if self._set_control_delay:
+                gevent.sleep(self._set_control_delay)
         else:
             item.wait(self._network_timeout)  # wait for acknowledge from the server
 
-    def rfc2217_flow_server_ready(self):
-        """\
-        check if server is ready to receive data. block for some time when
-        not.
-        """
-        #~ if self._remote_suspend_flow:
-        #~     wait---
-
     def get_modem_state(self):
         """\
         get last modem state (cached value. If value is "old", request a new
@@ -841,16 +1030,10 @@ class Serial(base.SerialBase):
         # active modem state polling enabled? is the value fresh enough?
         if self._poll_modem_state and self._modemstate_timeout.expired():
             self.logger.debug('polling modem state')
-            # when it is older, request an update
+            # when it is older, request an update and wait for the answer
+            self._modemstate_event.clear()
             self.rfc2217_send_subnegotiation(NOTIFY_MODEMSTATE)
-            timeout = Timeout(self._network_timeout)
-            while not timeout.expired():
-                gevent.sleep(0.05)    # prevent 100% CPU load
-                # when expiration time is updated, it means that there is a new
-                # value
-                if not self._modemstate_timeout.expired():
-                    break
-            else:
+            if not self._modemstate_event.wait(self._network_timeout):
                 self.logger.warning('poll for modem state failed')
             # even when there is a timeout, do not generate an error just
             # return the last known value. this way we can support buggy
@@ -2,9 +2,43 @@ import logging
 
 from .client import *
 
+try:
+    from gserial import posix
+except ImportError:
+    posix = None
 
-def escape(data):
-    return data.replace(IAC, IAC_DOUBLED)
+
+# SET_CONTROL value -> (serial attributes to set, log message). the value
+# is echoed back to the client once applied
+SET_CONTROL_CHANGES = {
+    SET_CONTROL_USE_NO_FLOW_CONTROL: ((('xonxoff', False), ('rtscts', False)), "changed flow control to None"),
+    SET_CONTROL_USE_SW_FLOW_CONTROL: ((('xonxoff', True),), "changed flow control to XON/XOFF"),
+    SET_CONTROL_USE_HW_FLOW_CONTROL: ((('rtscts', True),), "changed flow control to RTS/CTS"),
+    SET_CONTROL_BREAK_ON: ((('break_condition', True),), "changed BREAK to active"),
+    SET_CONTROL_BREAK_OFF: ((('break_condition', False),), "changed BREAK to inactive"),
+    SET_CONTROL_DTR_ON: ((('dtr', True),), "changed DTR to active"),
+    SET_CONTROL_DTR_OFF: ((('dtr', False),), "changed DTR to inactive"),
+    SET_CONTROL_RTS_ON: ((('rts', True),), "changed RTS to active"),
+    SET_CONTROL_RTS_OFF: ((('rts', False),), "changed RTS to inactive"),
+}
+
+# SET_CONTROL value -> complete reply frame echoing it, built once
+SET_CONTROL_REPLIES = {
+    value: SUBNEGOTIATION_START + SERVER_SET_CONTROL + value + SUBNEGOTIATION_END
+    for value in SET_CONTROL_CHANGES
+}
+
+# SET_CONTROL state requests (not implemented) -> name of the state
+SET_CONTROL_REQUESTS = {
+    SET_CONTROL_REQ_BREAK_STATE: 'break',
+    SET_CONTROL_REQ_DTR: 'DTR',
+    SET_CONTROL_REQ_RTS: 'RTS',
+}
+
+# modem state bits of the lines themselves (the low nibble holds the
+# *_CHANGE deltas)
+MODEMSTATE_LINES = (MODEMSTATE_MASK_CD | MODEMSTATE_MASK_RI |
+                    MODEMSTATE_MASK_DSR | MODEMSTATE_MASK_CTS)
 
 
 class PortManager(object):
@@ -25,10 +59,36 @@ class PortManager(object):
         self.mode = M_NORMAL
         self.suboption = None
         self.telnet_command = None
+        # replies to the data being filtered (see _send)
+        self._replies = None
+
+        # COM_PORT_OPTION handlers by sub option code
+        self._rfc2217_handlers = {
+            SET_BAUDRATE[0]: self._rfc2217_set_baudrate,
+            SET_DATASIZE[0]: self._rfc2217_set_datasize,
+            SET_PARITY[0]: self._rfc2217_set_parity,
+            SET_STOPSIZE[0]: self._rfc2217_set_stopsize,
+            SET_CONTROL[0]: self._rfc2217_set_control,
+            NOTIFY_LINESTATE[0]: self._rfc2217_notify_linestate,
+            NOTIFY_MODEMSTATE[0]: self._rfc2217_notify_modemstate,
+            FLOWCONTROL_SUSPEND[0]: self._rfc2217_flow_suspend,
+            FLOWCONTROL_RESUME[0]: self._rfc2217_flow_resume,
+            SET_LINESTATE_MASK[0]: self._rfc2217_set_linestate_mask,
+            SET_MODEMSTATE_MASK[0]: self._rfc2217_set_modemstate_mask,
+            PURGE_DATA[0]: self._rfc2217_purge_data,
+        }
+
+        # read all modem lines in one go when the serial port can
+        if isinstance(serial_port, Serial):
+            self._read_modemstate = self._read_rfc2217_modem_status
+        elif posix is not None and isinstance(serial_port, posix.Serial):
+            self._read_modemstate = self._read_posix_modem_status
+        else:
+            self._read_modemstate = self._read_modem_lines
 
         # states for modem/line control events
         self.modemstate_mask = 255
-        self.last_modemstate = None
+        self.last_modemstate = 0
         self.linstate_mask = 0
 
         # all supported telnet options
@@ -41,12 +101,18 @@ class PortManager(object):
             TelnetOption(self, 'we-RFC2217', COM_PORT_OPTION, WILL, WONT, DO, DONT, REQUESTED, self._client_ok),
             TelnetOption(self, 'they-RFC2217', COM_PORT_OPTION, DO, DONT, WILL, WONT, INACTIVE, self._client_ok),
         ]
+        # options by code. can have more than one option per code as some
+        # options are duplicated for 'us' and 'them'
+        self._telnet_options_by_code = {}
+        for option in self._telnet_options:
+            self._telnet_options_by_code.setdefault(option.option, []).append(option)
 
         # negotiate Telnet/RFC2217 -> send initial requests
         self.logger.debug("requesting initial Telnet/RFC 2217 options")
-        for option in self._telnet_options:
-            if option.state is REQUESTED:
-                self.telnet_send_option(option.send_yes, option.option)
+        self.connection.write(b''.join(
+            IAC + option.send_yes + option.option
+            for option in self._telnet_options
+            if option.state is REQUESTED))
         # issue 1st modem state notification
 
     def _client_ok(self):
@@ -68,14 +134,23 @@ class PortManager(object):
 
     # - outgoing telnet commands and options
 
+    def _send(self, data):
+        """\
+        Send telnet stuff. While filtering, replies are queued and sent
+        together once the received data is processed.
+        """
+        if self._replies is not None:
+            self._replies.append(data)
+        else:
+            self.connection.write(data)
+
     def telnet_send_option(self, action, option):
         """Send DO, DONT, WILL, WONT."""
-        self.connection.write(IAC + action + option)
+        self._send(IAC + action + option)
 
     def rfc2217_send_subnegotiation(self, option, value=b''):
         """Subnegotiation of RFC 2217 parameters."""
-        value = value.replace(IAC, IAC_DOUBLED)
-        self.connection.write(IAC + SB + COM_PORT_OPTION + option + value + IAC + SE)
+        self._send(b''.join((SUBNEGOTIATION_START, option, escape(value), SUBNEGOTIATION_END)))
 
     # - check modem lines, needs to be called periodically from user to
     # establish polling
@@ -85,21 +160,11 @@ class PortManager(object):
         read control lines from serial port and compare the last value sent to remote.
         send updates on changes.
         """
-        modemstate = (
-            (self.serial.cts and MODEMSTATE_MASK_CTS) |
-            (self.serial.dsr and MODEMSTATE_MASK_DSR) |
-            (self.serial.ri and MODEMSTATE_MASK_RI) |
-            (self.serial.cd and MODEMSTATE_MASK_CD))
-        # check what has changed
-        deltas = modemstate ^ (self.last_modemstate or 0)  # when last is None -> 0
-        if deltas & MODEMSTATE_MASK_CTS:
-            modemstate |= MODEMSTATE_MASK_CTS_CHANGE
-        if deltas & MODEMSTATE_MASK_DSR:
-            modemstate |= MODEMSTATE_MASK_DSR_CHANGE
-        if deltas & MODEMSTATE_MASK_RI:
-            modemstate |= MODEMSTATE_MASK_RI_CHANGE
-        if deltas & MODEMSTATE_MASK_CD:
-            modemstate |= MODEMSTATE_MASK_CD_CHANGE
+        modemstate = self._read_modemstate()
+        # check what has changed. each *_CHANGE bit sits 4 bits below the
+        # bit of its line, so all change bits are set at once
+        deltas = modemstate ^ self.last_modemstate
+        modemstate |= deltas >> 4
         # if new state is different and the mask allows this change, send
         # notification. suppress notifications when client is not rfc2217
         if modemstate != self.last_modemstate or force_notification:
@@ -107,11 +172,38 @@ class PortManager(object):
                 self.rfc2217_send_subnegotiation(
                     SERVER_NOTIFY_MODEMSTATE,
                     to_bytes([modemstate & self.modemstate_mask]))
-                self.logger.info("NOTIFY_MODEMSTATE: {}".format(modemstate))
+                self.logger.info("NOTIFY_MODEMSTATE: %s", modemstate)
             # save last state, but forget about deltas.
             # otherwise it would also notify about changing deltas which is
             # probably not very useful
-            self.last_modemstate = modemstate & 0xf0
+            self.last_modemstate = modemstate & MODEMSTATE_LINES
+
+    def _read_modem_lines(self):
+        """Read the modem lines one by one as MODEMSTATE_MASK_* bits."""
+        return (
+            (self.serial.cts and MODEMSTATE_MASK_CTS) |
+            (self.serial.dsr and MODEMSTATE_MASK_DSR) |
+            (self.serial.ri and MODEMSTATE_MASK_RI) |
+            (self.serial.cd and MODEMSTATE_MASK_CD))
+
+    def _read_rfc2217_modem_status(self):
+        """\
+        Read the modem state of a RFC2217 client port. The remote state also
+        carries the *_CHANGE delta bits: keep only the line bits.
+        """
+        return self.serial.modem_status() & MODEMSTATE_LINES
+
+    def _read_posix_modem_status(self):
+        """\
+        Read the modem lines with a single ioctl and translate the TIOCM_*
+        bits to MODEMSTATE_MASK_* bits.
+        """
+        status = self.serial.modem_status()
+        return (
+            (status & posix.TIOCM_CTS and MODEMSTATE_MASK_CTS) |
+            (status & posix.TIOCM_DSR and MODEMSTATE_MASK_DSR) |
+            (status & posix.TIOCM_RI and MODEMSTATE_MASK_RI) |
+            (status & posix.TIOCM_CD and MODEMSTATE_MASK_CD))
 
     # - outgoing data escaping
 
@@ -123,59 +215,89 @@ class PortManager(object):
     def filter(self, data):
         """\
         Handle a bunch of incoming bytes. This is a generator. It will yield
-        all characters not of interest for Telnet/RFC 2217.
+        all data not of interest for Telnet/RFC 2217, in chunks of
+        consecutive bytes.
 
         The idea is that the reader thread pushes data from the socket through
         this filter:
 
-        for byte in filter(socket.recv(1024)):
+        for chunk in filter(socket.recv(4096)):
             # do things like CR/LF conversion/whatever
             # and write data to the serial port
-            serial.write(byte)
+            serial.write(chunk)
 
         (socket error handling code left as exercise for the reader)
         """
-        for byte in iter_bytes(data):
-            if self.mode == M_NORMAL:
-                # interpret as command or as data
-                if byte == IAC:
-                    self.mode = M_IAC_SEEN
-                else:
-                    # store data in sub option buffer or pass it to our
-                    # consumer depending on state
-                    if self.suboption is not None:
-                        self.suboption += byte
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        find = data.find
+        pos, end = 0, len(data)
+        # answers to everything in data go out in a single write
+        self._replies = replies = []
+        try:
+            while pos < end:
+                if self.mode == M_NORMAL:
+                    # everything up to the next IAC is data: pass it on or store
+                    # it in the sub option buffer, depending on state, in one go
+                    iac = find(IAC, pos)
+                    if iac < 0:
+                        iac = end
                     else:
-                        yield byte
-            elif self.mode == M_IAC_SEEN:
-                if byte == IAC:
-                    # interpret as command doubled -> insert character
-                    # itself
-                    if self.suboption is not None:
-                        self.suboption += byte
+                        self.mode = M_IAC_SEEN
+                    if iac > pos:
+                        if self.suboption is not None:
+                            # append through a view: no temporary copy
+                            self.suboption += memoryview(data)[pos:iac]
+                        else:
+                            yield data if iac - pos == end else data[pos:iac]
+                    pos = iac + 1
+                    continue
+                code = data[pos]
+                pos += 1
+                if self.mode == M_IAC_SEEN:
+                    if code == IAC_CODE:
+                        # interpret as command doubled -> insert character
+                        # itself
+                        if self.suboption is not None:
+                            self.suboption += IAC
+                        else:
+                            yield IAC
+                        self.mode = M_NORMAL
+                    elif code == SB_CODE:
+                        # sub option start
+                        self.suboption = bytearray()
+                        self.mode = M_NORMAL
+                    elif code == SE_CODE:
+                        # sub option end -> process it now
+                        self._telnet_process_subnegotiation(self.suboption)
+                        self.suboption = None
+                        self.mode = M_NORMAL
+                    elif code in NEGOTIATION_CODES:
+                        # negotiation
+                        self.telnet_command = SINGLE_BYTES[code]
+                        self.mode = M_NEGOTIATE
                     else:
-                        yield byte
-                    self.mode = M_NORMAL
-                elif byte == SB:
-                    # sub option start
-                    self.suboption = bytearray()
-                    self.mode = M_NORMAL
-                elif byte == SE:
-                    # sub option end -> process it now
-                    self._telnet_process_subnegotiation(bytes(self.suboption))
-                    self.suboption = None
+                        # other telnet commands
+                        self._telnet_process_command(SINGLE_BYTES[code])
+                        self.mode = M_NORMAL
+                elif self.mode == M_NEGOTIATE:  # DO, DONT, WILL, WONT was received, option now following
+                    self._telnet_negotiate_option(self.telnet_command, SINGLE_BYTES[code])
                     self.mode = M_NORMAL
-                elif byte in (DO, DONT, WILL, WONT):
-                    # negotiation
-                    self.telnet_command = byte
-                    self.mode = M_NEGOTIATE
-                else:
-                    # other telnet commands
-                    self._telnet_process_command(byte)
-                    self.mode = M_NORMAL
-            elif self.mode == M_NEGOTIATE:  # DO, DONT, WILL, WONT was received, option now following
-                self._telnet_negotiate_option(self.telnet_command, byte)
-                self.mode = M_NORMAL
+        finally:
+            self._replies = None
+            if replies:
+                self.connection.write(b''.join(replies))
+
+    def filter_bytes(self, data):
+        """\
+        Same as filter() but returns all data of interest in a single bytes
+        object. Data without telnet sequences is returned as is.
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if self.mode == M_NORMAL and self.suboption is None and IAC not in data:
+            return data
+        return b''.join(self.filter(data))
 
     # - incoming telnet commands and options
 
@@ -188,14 +310,11 @@ class PortManager(object):
         """Process incoming DO, DONT, WILL, WONT."""
         # check our registered telnet options and forward command to them
         # they know themselves if they have to answer or not
-        known = False
-        for item in self._telnet_options:
-            # can have more than one match! as some options are duplicated for
-            # 'us' and 'them'
-            if item.option == option:
+        items = self._telnet_options_by_code.get(option)
+        if items:
+            for item in items:
                 item.process_incoming(command)
-                known = True
-        if not known:
+        else:
             # handle unknown options
             # only answer to positive requests and deny them
             if command == WILL or command == DO:
@@ -203,161 +322,146 @@ class PortManager(object):
                 self.logger.warning("rejected Telnet option: {!r}".format(option))
 
     def _telnet_process_subnegotiation(self, suboption):
-        """Process subnegotiation, the data between IAC SB and IAC SE."""
-        if suboption[0:1] == COM_PORT_OPTION:
-            self.logger.debug('received COM_PORT_OPTION: {!r}'.format(suboption))
-            if suboption[1:2] == SET_BAUDRATE:
-                backup = self.serial.baudrate
-                try:
-                    (baudrate,) = struct.unpack(b"!I", suboption[2:6])
-                    if baudrate != 0:
-                        self.serial.baudrate = baudrate
-                except ValueError as e:
-                    self.logger.error("failed to set baud rate: {}".format(e))
-                    self.serial.baudrate = backup
-                else:
-                    self.logger.info("{} baud rate: {}".format('set' if baudrate else 'get', self.serial.baudrate))
-                self.rfc2217_send_subnegotiation(SERVER_SET_BAUDRATE, struct.pack(b"!I", self.serial.baudrate))
-            elif suboption[1:2] == SET_DATASIZE:
-                backup = self.serial.bytesize
-                try:
-                    (datasize,) = struct.unpack(b"!B", suboption[2:3])
-                    if datasize != 0:
-                        self.serial.bytesize = datasize
-                except ValueError as e:
-                    self.logger.error("failed to set data size: {}".format(e))
-                    self.serial.bytesize = backup
-                else:
-                    self.logger.info("{} data size: {}".format('set' if datasize else 'get', self.serial.bytesize))
-                self.rfc2217_send_subnegotiation(SERVER_SET_DATASIZE, struct.pack(b"!B", self.serial.bytesize))
-            elif suboption[1:2] == SET_PARITY:
-                backup = self.serial.parity
-                try:
-                    parity = struct.unpack(b"!B", suboption[2:3])[0]
-                    if parity != 0:
-                        self.serial.parity = RFC2217_REVERSE_PARITY_MAP[parity]
-                except ValueError as e:
-                    self.logger.error("failed to set parity: {}".format(e))
-                    self.serial.parity = backup
-                else:
-                    self.logger.info("{} parity: {}".format('set' if parity else 'get', self.serial.parity))
-                self.rfc2217_send_subnegotiation(
-                    SERVER_SET_PARITY,
-                    struct.pack(b"!B", RFC2217_PARITY_MAP[self.serial.parity]))
-            elif suboption[1:2] == SET_STOPSIZE:
-                backup = self.serial.stopbits
-                try:
-                    stopbits = struct.unpack(b"!B", suboption[2:3])[0]
-                    if stopbits != 0:
-                        self.serial.stopbits = RFC2217_REVERSE_STOPBIT_MAP[stopbits]
-                except ValueError as e:
-                    self.logger.error("failed to set stop bits: {}".format(e))
-                    self.serial.stopbits = backup
-                else:
-                    self.logger.info("{} stop bits: {}".format('set' if stopbits else 'get', self.serial.stopbits))
-                self.rfc2217_send_subnegotiation(
-                    SERVER_SET_STOPSIZE,
-                    struct.pack(b"!B", RFC2217_STOPBIT_MAP[self.serial.stopbits]))
-            elif suboption[1:2] == SET_CONTROL:
-                if suboption[2:3] == SET_CONTROL_REQ_FLOW_SETTING:
-                    if self.serial.xonxoff:
-                        self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_USE_SW_FLOW_CONTROL)
-                    elif self.serial.rtscts:
-                        self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_USE_HW_FLOW_CONTROL)
-                    else:
-                        self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_USE_NO_FLOW_CONTROL)
-                elif suboption[2:3] == SET_CONTROL_USE_NO_FLOW_CONTROL:
-                    self.serial.xonxoff = False
-                    self.serial.rtscts = False
-                    self.logger.info("changed flow control to None")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_USE_NO_FLOW_CONTROL)
-                elif suboption[2:3] == SET_CONTROL_USE_SW_FLOW_CONTROL:
-                    self.serial.xonxoff = True
-                    self.logger.info("changed flow control to XON/XOFF")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_USE_SW_FLOW_CONTROL)
-                elif suboption[2:3] == SET_CONTROL_USE_HW_FLOW_CONTROL:
-                    self.serial.rtscts = True
-                    self.logger.info("changed flow control to RTS/CTS")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_USE_HW_FLOW_CONTROL)
-                elif suboption[2:3] == SET_CONTROL_REQ_BREAK_STATE:
-                    self.logger.warning("requested break state - not implemented")
-                    pass  # XXX needs cached value
-                elif suboption[2:3] == SET_CONTROL_BREAK_ON:
-                    self.serial.break_condition = True
-                    self.logger.info("changed BREAK to active")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_BREAK_ON)
-                elif suboption[2:3] == SET_CONTROL_BREAK_OFF:
-                    self.serial.break_condition = False
-                    self.logger.info("changed BREAK to inactive")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_BREAK_OFF)
-                elif suboption[2:3] == SET_CONTROL_REQ_DTR:
-                    self.logger.warning("requested DTR state - not implemented")
-                    pass  # XXX needs cached value
-                elif suboption[2:3] == SET_CONTROL_DTR_ON:
-                    self.serial.dtr = True
-                    self.logger.info("changed DTR to active")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_DTR_ON)
-                elif suboption[2:3] == SET_CONTROL_DTR_OFF:
-                    self.serial.dtr = False
-                    self.logger.info("changed DTR to inactive")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_DTR_OFF)
-                elif suboption[2:3] == SET_CONTROL_REQ_RTS:
-                    self.logger.warning("requested RTS state - not implemented")
-                    pass  # XXX needs cached value
-                    #~ self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_RTS_ON)
-                elif suboption[2:3] == SET_CONTROL_RTS_ON:
-                    self.serial.rts = True
-                    self.logger.info("changed RTS to active")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_RTS_ON)
-                elif suboption[2:3] == SET_CONTROL_RTS_OFF:
-                    self.serial.rts = False
-                    self.logger.info("changed RTS to inactive")
-                    self.rfc2217_send_subnegotiation(SERVER_SET_CONTROL, SET_CONTROL_RTS_OFF)
-                #~ elif suboption[2:3] == SET_CONTROL_REQ_FLOW_SETTING_IN:
-                #~ elif suboption[2:3] == SET_CONTROL_USE_NO_FLOW_CONTROL_IN:
-                #~ elif suboption[2:3] == SET_CONTROL_USE_SW_FLOW_CONTOL_IN:
-                #~ elif suboption[2:3] == SET_CONTROL_USE_HW_FLOW_CONTOL_IN:
-                #~ elif suboption[2:3] == SET_CONTROL_USE_DCD_FLOW_CONTROL:
-                #~ elif suboption[2:3] == SET_CONTROL_USE_DTR_FLOW_CONTROL:
-                #~ elif suboption[2:3] == SET_CONTROL_USE_DSR_FLOW_CONTROL:
-            elif suboption[1:2] == NOTIFY_LINESTATE:
-                # client polls for current state
-                self.rfc2217_send_subnegotiation(
-                    SERVER_NOTIFY_LINESTATE,
-                    to_bytes([0]))   # sorry, nothing like that implemented
-            elif suboption[1:2] == NOTIFY_MODEMSTATE:
-                self.logger.info("request for modem state")
-                # client polls for current state
-                self.check_modem_lines(force_notification=True)
-            elif suboption[1:2] == FLOWCONTROL_SUSPEND:
-                self.logger.info("suspend")
-                self._remote_suspend_flow = True
-            elif suboption[1:2] == FLOWCONTROL_RESUME:
-                self.logger.info("resume")
-                self._remote_suspend_flow = False
-            elif suboption[1:2] == SET_LINESTATE_MASK:
-                self.linstate_mask = ord(suboption[2:3])  # ensure it is a number
-                self.logger.info("line state mask: 0x{:02x}".format(self.linstate_mask))
-            elif suboption[1:2] == SET_MODEMSTATE_MASK:
-                self.modemstate_mask = ord(suboption[2:3])  # ensure it is a number
-                self.logger.info("modem state mask: 0x{:02x}".format(self.modemstate_mask))
-            elif suboption[1:2] == PURGE_DATA:
-                if suboption[2:3] == PURGE_RECEIVE_BUFFER:
-                    self.serial.reset_input_buffer()
-                    self.logger.info("purge in")
-                    self.rfc2217_send_subnegotiation(SERVER_PURGE_DATA, PURGE_RECEIVE_BUFFER)
-                elif suboption[2:3] == PURGE_TRANSMIT_BUFFER:
-                    self.serial.reset_output_buffer()
-                    self.logger.info("purge out")
-                    self.rfc2217_send_subnegotiation(SERVER_PURGE_DATA, PURGE_TRANSMIT_BUFFER)
-                elif suboption[2:3] == PURGE_BOTH_BUFFERS:
-                    self.serial.reset_input_buffer()
-                    self.serial.reset_output_buffer()
-                    self.logger.info("purge both")
-                    self.rfc2217_send_subnegotiation(SERVER_PURGE_DATA, PURGE_BOTH_BUFFERS)
-                else:
-                    self.logger.error("undefined PURGE_DATA: {!r}".format(list(suboption[2:])))
+        """\
+        Process subnegotiation, the data between IAC SB and IAC SE. The
+        bytearray is not copied: handlers slice what they keep.
+        """
+        if suboption[:1] == COM_PORT_OPTION:
+            self.logger.debug('received COM_PORT_OPTION: %r', suboption)
+            # look the sub option up by its int code: no slice to allocate
+            code = suboption[1] if len(suboption) > 1 else None
+            handler = self._rfc2217_handlers.get(code)
+            if handler is not None:
+                handler(suboption)
             else:
                 self.logger.error("undefined COM_PORT_OPTION: {!r}".format(list(suboption[1:])))
         else:
             self.logger.warning("unknown subnegotiation: {!r}".format(suboption))
+
+    def _rfc2217_set_baudrate(self, suboption):
+        backup = self.serial.baudrate
+        try:
+            (baudrate,) = UINT32.unpack_from(suboption, 2)
+            if baudrate != 0:
+                self.serial.baudrate = baudrate
+        except ValueError as e:
+            self.logger.error("failed to set baud rate: {}".format(e))
+            self.serial.baudrate = current = backup
+        else:
+            current = self.serial.baudrate
+            self.logger.info("%s baud rate: %s", 'set' if baudrate else 'get', current)
+        self.rfc2217_send_subnegotiation(SERVER_SET_BAUDRATE, UINT32.pack(current))
+
+    def _rfc2217_set_datasize(self, suboption):
+        backup = self.serial.bytesize
+        try:
+            (datasize,) = UINT8.unpack_from(suboption, 2)
+            if datasize != 0:
+                self.serial.bytesize = datasize
+        except ValueError as e:
+            self.logger.error("failed to set data size: {}".format(e))
+            self.serial.bytesize = current = backup
+        else:
+            current = self.serial.bytesize
+            self.logger.info("%s data size: %s", 'set' if datasize else 'get', current)
+        self.rfc2217_send_subnegotiation(SERVER_SET_DATASIZE, UINT8.pack(current))
+
+    def _rfc2217_set_parity(self, suboption):
+        backup = self.serial.parity
+        try:
+            parity = UINT8.unpack_from(suboption, 2)[0]
+            if parity != 0:
+                self.serial.parity = RFC2217_REVERSE_PARITY_MAP[parity]
+        except ValueError as e:
+            self.logger.error("failed to set parity: {}".format(e))
+            self.serial.parity = current = backup
+        else:
+            current = self.serial.parity
+            self.logger.info("%s parity: %s", 'set' if parity else 'get', current)
+        self.rfc2217_send_subnegotiation(
+            SERVER_SET_PARITY,
+            UINT8.pack(RFC2217_PARITY_MAP[current]))
+
+    def _rfc2217_set_stopsize(self, suboption):
+        backup = self.serial.stopbits
+        try:
+            stopbits = UINT8.unpack_from(suboption, 2)[0]
+            if stopbits != 0:
+                self.serial.stopbits = RFC2217_REVERSE_STOPBIT_MAP[stopbits]
+        except ValueError as e:
+            self.logger.error("failed to set stop bits: {}".format(e))
+            self.serial.stopbits = current = backup
+        else:
+            current = self.serial.stopbits
+            self.logger.info("%s stop bits: %s", 'set' if stopbits else 'get', current)
+        self.rfc2217_send_subnegotiation(
+            SERVER_SET_STOPSIZE,
+            UINT8.pack(RFC2217_STOPBIT_MAP[current]))
+
+    def _rfc2217_set_control(self, suboption):
+        control = bytes(suboption[2:3])
+        change = SET_CONTROL_CHANGES.get(control)
+        if change is not None:
+            changes, message = change
+            for name, value in changes:
+                setattr(self.serial, name, value)
+            self.logger.info(message)
+            self._send(SET_CONTROL_REPLIES[control])
+        elif control == SET_CONTROL_REQ_FLOW_SETTING:
+            if self.serial.xonxoff:
+                self._send(SET_CONTROL_REPLIES[SET_CONTROL_USE_SW_FLOW_CONTROL])
+            elif self.serial.rtscts:
+                self._send(SET_CONTROL_REPLIES[SET_CONTROL_USE_HW_FLOW_CONTROL])
+            else:
+                self._send(SET_CONTROL_REPLIES[SET_CONTROL_USE_NO_FLOW_CONTROL])
+        elif control in SET_CONTROL_REQUESTS:
+            # XXX needs cached value
+            self.logger.warning("requested %s state - not implemented", SET_CONTROL_REQUESTS[control])
+        #~ SET_CONTROL_REQ_FLOW_SETTING_IN, SET_CONTROL_USE_NO_FLOW_CONTROL_IN,
+        #~ SET_CONTROL_USE_SW_FLOW_CONTOL_IN, SET_CONTROL_USE_HW_FLOW_CONTOL_IN,
+        #~ SET_CONTROL_USE_DCD_FLOW_CONTROL, SET_CONTROL_USE_DTR_FLOW_CONTROL,
+        #~ SET_CONTROL_USE_DSR_FLOW_CONTROL are not supported
+
+    def _rfc2217_notify_linestate(self, suboption):
+        # client polls for current state
+        self.rfc2217_send_subnegotiation(
+            SERVER_NOTIFY_LINESTATE,
+            to_bytes([0]))   # sorry, nothing like that implemented
+
+    def _rfc2217_notify_modemstate(self, suboption):
+        self.logger.info("request for modem state")
+        # client polls for current state
+        self.check_modem_lines(force_notification=True)
+
+    def _rfc2217_flow_suspend(self, suboption):
+        self.logger.info("suspend")
+        self._remote_suspend_flow = True
+
+    def _rfc2217_flow_resume(self, suboption):
+        self.logger.info("resume")
+        self._remote_suspend_flow = False
+
+    def _rfc2217_set_linestate_mask(self, suboption):
+        self.linstate_mask = suboption[2]
+        self.logger.info("line state mask: 0x%02x", self.linstate_mask)
+
+    def _rfc2217_set_modemstate_mask(self, suboption):
+        self.modemstate_mask = suboption[2]
+        self.logger.info("modem state mask: 0x%02x", self.modemstate_mask)
+
+    def _rfc2217_purge_data(self, suboption):
+        purge = bytes(suboption[2:3])
+        if purge == PURGE_RECEIVE_BUFFER:
+            self.serial.reset_input_buffer()
+            self.logger.info("purge in")
+        elif purge == PURGE_TRANSMIT_BUFFER:
+            self.serial.reset_output_buffer()
+            self.logger.info("purge out")
+        elif purge == PURGE_BOTH_BUFFERS:
+            self.serial.reset_input_buffer()
+            self.serial.reset_output_buffer()
+            self.logger.info("purge both")
+        else:
+            self.logger.error("undefined PURGE_DATA: {!r}".format(list(suboption[2:])))
+            return
+        self.rfc2217_send_subnegotiation(SERVER_PURGE_DATA, purge)
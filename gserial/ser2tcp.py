@@ -1,6 +1,7 @@
 import os
 import logging
 
+import gevent.pool
 import gevent.server
 
 import gserial
@@ -9,9 +10,13 @@ from gserial.rfc2217.manager import PortManager
 
 log = logging.getLogger('gserial.rfc2217.server')
 
+# max bytes taken from the tcp socket in one go
+RECV_SIZE = 16 * 1024
+
 
 def serial_to_tcp(manager):
-    src = manager.serial.read()
+    serial = manager.serial
+    src = serial.read(serial.in_waiting or 1)
     if src:
         # escape outgoing data when needed (Telnet IAC (0xff) character)
         dst = manager.escape(src)
@@ -20,10 +25,13 @@ def serial_to_tcp(manager):
 
 
 def tcp_to_serial(manager):
-    src = manager.connection.recv(1024)
+    # on a connection with reuse_buffer the returned data is a view only
+    # valid until the next call
+    src = manager.connection.recv(RECV_SIZE)
     if src:
-        dst = b''.join(manager.filter(src))
-        manager.serial.write(dst)
+        dst = manager.filter_bytes(src)
+        if dst:
+            manager.serial.write(dst)
     return src
 
 
@@ -48,11 +56,12 @@ def serial_for_config(config):
     opts = dict(config)
     serial_url = opts.pop('url')
     if 'open' in opts:
-        opts['do_not_open'] = not config.pop('open')
+        opts['do_not_open'] = not opts.pop('open')
     if 'parity' in config:
         opts['parity'] = config['parity'][:1].upper()
     if 'timeout' in config:
         opts['timeout'] = config['timeout'] if config['timeout'] >= 0 else None
+    log.debug('opening %s with %r', serial_url, opts)
     serial = gserial.serial_for_url(serial_url, **opts)
     return serial
 
@@ -64,16 +73,18 @@ IPTOS_THROUGHPUT = 0x08
 IPTOS_RELIABILITY = 0x04
 IPTOS_MINCOST = 0x02
 
+TOS = {
+    'lowdelay': IPTOS_LOWDELAY,
+    'throughput': IPTOS_THROUGHPUT,
+    'reliability': IPTOS_RELIABILITY,
+    'mincost': IPTOS_MINCOST,
+}
+TOS.update({name.upper(): value for name, value in TOS.items()})
+TOS.update({value: value for value in tuple(TOS.values())})
+
+
 def tos(value):
-    if tos in ('lowdelay', 'LOWDELAY', IPTOS_LOWDELAY):
-        return IPTOS_LOWDELAY
-    elif tos in ('throughput', 'THROUGHPUT', IPTOS_THROUGHPUT):
-        IPTOS_THROUGHPUT
-    elif tos in ('reliability', 'RELIABILITY', IPTOS_RELIABILITY):
-        return IPTOS_RELIABILITY
-    elif tos in ('mincost', 'MINCOST', IPTOS_MINCOST):
-        return IPTOS_MINCOST
-    return IPTOS_NORMAL
+    return TOS.get(value, IPTOS_NORMAL)
 
 
 class RawPortManager:
@@ -85,6 +96,9 @@ class RawPortManager:
     def filter(self, data):
         return data,
 
+    def filter_bytes(self, data):
+        return data
+
     def escape(self, data):
         return data
 
@@ -92,15 +106,30 @@ class RawPortManager:
 class Bridge:
 
     class Connection:
-        def __init__(self, sock):
+        def __init__(self, sock, reuse_buffer=False):
             self.write = sock.sendall
-            self.recv = sock.recv
+            if reuse_buffer:
+                self._recv_into = sock.recv_into
+                self._buffer = memoryview(bytearray(RECV_SIZE))
+                self.recv = self._recv_view
+            else:
+                self.recv = sock.recv
+
+        def _recv_view(self, size):
+            """\
+            receive into a buffer reused across calls. The returned view
+            is only valid until the next recv.
+            """
+            return self._buffer[:self._recv_into(self._buffer, size)]
 
     def __init__(self, config):
         sl = config['url']
         self.listener = config.pop('listener')
-        self.no_delay = config.pop('no_delay', False)
+        self.no_delay = config.pop('no_delay', True)
         self.tos = tos(config.pop('tos', None))
+        # kernel socket buffer sizes. None keeps the kernel defaults
+        self.recv_buf = config.pop('recv_buf', None)
+        self.send_buf = config.pop('send_buf', None)
         self.mode = config.pop('mode', 'rfc2217')
         self.config = config
         self.log = log.getChild('Bridge({}<->{})'.format(sl, self.listener))
@@ -109,7 +138,9 @@ class Bridge:
         tcp_listener = self.listener
         if isinstance(tcp_listener, list):
             tcp_listener = tuple(tcp_listener)
-        self.server = gevent.server.StreamServer(tcp_listener, self.handle)
+        # connections run in a pool so stop() can cancel them all at once
+        self.server = gevent.server.StreamServer(
+            tcp_listener, self.handle, spawn=gevent.pool.Pool())
         self.log.info('Ready to accept requests')
         self.server.serve_forever()
 
@@ -150,9 +181,17 @@ class Bridge:
             sock.setsockopt(gevent.socket.IPPROTO_TCP,
                             gevent.socket.TCP_NODELAY, 1)
         sock.setsockopt(gevent.socket.SOL_IP, gevent.socket.IP_TOS, self.tos)
+        if self.recv_buf is not None:
+            sock.setsockopt(gevent.socket.SOL_SOCKET,
+                            gevent.socket.SO_RCVBUF, self.recv_buf)
+        if self.send_buf is not None:
+            sock.setsockopt(gevent.socket.SOL_SOCKET,
+                            gevent.socket.SO_SNDBUF, self.send_buf)
         serial = serial_for_config(self.config)
-        connection = self.Connection(sock)
         rfc2217 = self.mode.lower() == 'rfc2217'
+        # raw data goes untouched to the serial write, which is done with it
+        # before the next recv: no need for a new bytes object per packet
+        connection = self.Connection(sock, reuse_buffer=not rfc2217)
         Manager = PortManager if rfc2217 else RawPortManager
         manager = Manager(serial, connection)
         tasks = [
@@ -163,33 +202,55 @@ class Bridge:
             tasks.append(
                 gevent.spawn(self.poll_statusline, manager)
             )
-        gevent.joinall(tasks, count=1)
-        self.log.info('disconnection from %r', addr)
-        gevent.killall(tasks)
-        serial.close()
-        sock.close()
+        try:
+            gevent.wait(tasks, count=1)
+            self.log.info('disconnection from %r', addr)
+        finally:
+            # also reached when the server stops and kills this handler
+            gevent.killall(tasks)
+            serial.close()
+            sock.close()
+
+
+def _load_toml(fobj):
+    from toml import load
+    return load(fobj)
+
+
+def _load_yaml(fobj):
+    import yaml
+    return yaml.load(fobj, Loader=yaml.Loader)
+
+
+def _load_json(fobj):
+    from json import load
+    return load(fobj)
+
+
+def _load_py(fobj):
+    # python only supports a single detector definition
+    r = {}
+    exec(fobj.read(), None, r)
+    return [r]
+
+
+CONFIG_LOADERS = {
+    '.toml': _load_toml,
+    '.yml': _load_yaml,
+    '.yaml': _load_yaml,
+    '.json': _load_json,
+    '.py': _load_py,
+}
 
 
 def load_config(filename):
     if not os.path.exists(filename):
         raise ValueError('configuration file does not exist')
-    ext = os.path.splitext(filename)[-1]
-    if ext.endswith('toml'):
-        from toml import load
-    elif ext.endswith('yml') or ext.endswith('.yaml'):
-        import yaml
-        def load(fobj):
-            return yaml.load(fobj, Loader=yaml.Loader)
-    elif ext.endswith('json'):
-        from json import load
-    elif ext.endswith('py'):
-        # python only supports a single detector definition
-        def load(fobj):
-            r = {}
-            exec(fobj.read(), None, r)
-            return [r]
-    else:
-        raise NotImplementedError
+    ext = os.path.splitext(filename)[-1].lower()
+    load = CONFIG_LOADERS.get(ext)
+    if load is None:
+        raise NotImplementedError(
+            'unsupported configuration file type {!r}'.format(ext))
     with open(filename)as fobj:
         return load(fobj)
 
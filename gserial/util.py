@@ -1,22 +1,30 @@
 import time
 
 
+# one shared 1 byte object per possible value
+SINGLE_BYTES = tuple(bytes((i,)) for i in range(256))
+
+
 def iter_bytes(b):
     """Iterate over bytes, returning bytes instead of ints (python3)"""
     if isinstance(b, memoryview):
         b = b.tobytes()
-    for i in range(len(b)):
-        yield b[i:i + 1]
+    return map(SINGLE_BYTES.__getitem__, b)
 
 
 def to_bytes(seq):
     """convert a sequence to a bytes type"""
-    if isinstance(seq, bytes):
+    # exact type dispatch first: plain bytes is by far the most common input
+    t = type(seq)
+    if t is bytes:
         return seq
-    elif isinstance(seq, bytearray):
+    elif t is bytearray:
         return bytes(seq)
-    elif isinstance(seq, memoryview):
+    elif t is memoryview:
         return seq.tobytes()
+    # subclasses and other sequences (memoryview can't be subclassed)
+    elif isinstance(seq, bytes):
+        return seq
     elif isinstance(seq, str):
         raise TypeError('str is not supported, please encode to bytes: {!r}'.format(seq))
     else:
@@ -39,6 +47,8 @@ class Strip(object):
 
     __slots__ = "obj", "max_len"
 
+    suffix = " [...]"
+
     def __init__(self, obj, max_len=80):
         self.obj = obj
         self.max_len = max_len
@@ -46,7 +56,7 @@ class Strip(object):
     def __strip(self, s):
         max_len = self.max_len
         if len(s) > max_len:
-            suffix = " [...]"
+            suffix = self.suffix
             s = s[: max_len - len(suffix)] + suffix
         return s
 
@@ -81,7 +91,8 @@ class Timeout(object):
 
     def expired(self):
         """Return a boolean, telling if the timeout has expired"""
-        return self.target_time is not None and self.time_left() <= 0
+        target_time = self.target_time
+        return target_time is not None and time.monotonic() >= target_time
 
     def time_left(self):
         """Return how many seconds are left until the timeout expires"""
@@ -89,14 +100,8 @@ class Timeout(object):
             return 0
         elif self.is_infinite:
             return None
-        else:
-            delta = self.target_time - time.monotonic()
-            if delta > self.duration:
-                # clock jumped, recalculate
-                self.target_time = time.monotonic() + self.duration
-                return self.duration
-            else:
-                return max(0, delta)
+        # monotonic clock: it never jumps, the delta can't exceed duration
+        return max(0, self.target_time - time.monotonic())
 
     def restart(self, duration):
         """
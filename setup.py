@@ -23,7 +23,7 @@ setup(
         'Programming Language :: Python :: 3.7',
     ],
     description="A gevent friendly serial line",
-    install_requires=['gevent', 'pyserial'],
+    install_requires=['gevent'],
     extras_require={
         'ser2tcp': ['pyyaml', 'toml']
     },
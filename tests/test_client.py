@@ -0,0 +1,48 @@
+import socket
+import unittest
+
+import gevent
+import gevent.lock
+import gevent.socket
+
+from gserial.exception import SerialException
+from gserial.rfc2217 import client
+
+
+class TestCoalescedWrite(unittest.TestCase):
+
+    def setUp(self):
+        # a connected port with coalesce_writes, without the rfc2217
+        # negotiation
+        self.local, self.remote = socket.socketpair()
+        self.addCleanup(self.local.close)
+        port = client.Serial()
+        port._socket = gevent.socket.socket(fileno=self.local.detach())
+        self.addCleanup(port._socket.close)
+        port._write_lock = gevent.lock.RLock()
+        port._write_buffer = bytearray()
+        port._coalesce_writes = True
+        port.is_open = True
+        self.addCleanup(setattr, port, 'is_open', False)
+        self.port = port
+
+    def test_buffered_data_is_sent(self):
+        self.assertEqual(self.port.write(b'a\xffb'), 3)
+        gevent.sleep(0)
+        self.assertEqual(self.remote.recv(10), b'a\xff\xffb')
+        self.remote.close()
+
+    def test_failed_flush_reaches_caller(self):
+        self.remote.close()
+        self.port.write(b'lost')
+        # let the flusher greenlet try to send
+        with self.assertLogs(client.log, 'ERROR'):
+            gevent.sleep(0)
+        with self.assertRaises(SerialException):
+            self.port.write(b'more')
+        with self.assertRaises(SerialException):
+            self.port.flush()
+
+
+if __name__ == '__main__':
+    unittest.main()
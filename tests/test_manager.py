@@ -0,0 +1,37 @@
+import unittest
+
+from gserial.rfc2217 import client
+from gserial.rfc2217.manager import PortManager
+
+
+class Connection(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def write(self, data):
+        self.sent.append(bytes(data))
+
+
+class TestModemState(unittest.TestCase):
+
+    def test_unchanged_rfc2217_port_is_not_notified(self):
+        port = client.Serial()
+        # pretend the port is connected: the modem state is served from cache
+        port.is_open = True
+        self.addCleanup(setattr, port, 'is_open', False)
+        port._poll_modem_state = False
+        # CTS, DSR and CD active plus the CTS delta bit from the server
+        port._modemstate = 0xb1
+        connection = Connection()
+        manager = PortManager(port, connection)
+        manager._client_is_rfc2217 = True
+        manager.check_modem_lines()
+        del connection.sent[:]
+        for _ in range(3):
+            manager.check_modem_lines()
+        self.assertEqual(connection.sent, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import pty
+import tty
+import array
+import unittest
+
+import gevent
+import gevent.socket
+
+import gserial
+
+
+class TestWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        self.addCleanup(os.close, self.master)
+        self.addCleanup(os.close, self.slave)
+        self.serial = gserial.Serial(os.ttyname(self.slave))
+        self.addCleanup(self.serial.close)
+
+    def read_master(self, size):
+        data = b''
+        with gevent.Timeout(5):
+            while len(data) < size:
+                gevent.socket.wait_read(self.master)
+                data += os.read(self.master, size - len(data))
+        return data
+
+    def check_write(self, data, expected):
+        # larger than the pty buffer: forces partial writes
+        reader = gevent.spawn(self.read_master, len(expected))
+        self.assertEqual(self.serial.write(data), len(expected))
+        self.assertEqual(reader.get(), expected)
+
+    def test_write_multi_byte_items(self):
+        data = array.array('H', range(32 * 1024))
+        self.check_write(memoryview(data), data.tobytes())
+
+    def test_write_non_contiguous(self):
+        data = bytes(range(256)) * 256
+        self.check_write(memoryview(data)[::2], data[::2])
+
+
+if __name__ == '__main__':
+    unittest.main()